@@ -0,0 +1,110 @@
+# Benchmark memory of parsed sheets
+#
+# Copyright IBM Corporation 2021
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Loads synthetic workbooks generated as by throughput.py and reports the
+# memory held by the parsed sheets per 100k cells, as packed sheets loaded
+# by transform and as object DataFrames read by pandas.read_excel.
+# Memory is measured with tracemalloc in a new process for each case.
+#
+# Usage: python benchmarks/memory.py [-l BYTES] [input folder]
+#
+# With -l the run fails if packed sheets take more than BYTES per 100k cells.
+
+import gc
+import os
+import sys
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import throughput
+import transform
+
+# Load all sheets of workbooks and keep them.
+# Returns cells and bytes allocated for the sheets.
+def measure(arguments):
+   kind, datapath, propnames, reader = arguments
+
+   # Modules are imported before measuring so only sheets are counted.
+   import numpy
+   import openpyxl
+   if kind == 'dataframe':
+      import pandas as pd
+
+   tracemalloc.start()
+   start = tracemalloc.get_traced_memory()[0]
+
+   sheets = []
+   cells = 0
+   for propname in propnames:
+      propfile = os.path.join(datapath, 'xlsx', propname + '.xlsx')
+      if kind == 'dataframe':
+         for name, df in pd.read_excel(propfile, sheet_name=None, dtype=object, header=0).items():
+            sheets.append(df)
+            cells += df.size
+      else:
+         job = throughput.newjob(datapath, os.path.join(datapath, 'resources'), propname, reader)
+         for name, sheet, frame in transform.loadframes(job):
+            sheets.append(frame)
+            cells += transform.sheetsize(frame)
+
+   # Release reader objects left in reference cycles.
+   gc.collect()
+   size = tracemalloc.get_traced_memory()[0] - start
+   tracemalloc.stop()
+
+   return {'cells': cells, 'bytes': size}
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmark memory of parsed sheets')
+   parser.add_argument('inputfolder', nargs='?', default=throughput.exampledata, help='data folder with xlsx workbooks to model (default: examples/vpcwebapp)')
+   for name, count in throughput.scaledsheets.items():
+      parser.add_argument('--' + name, type=int, dest=name, default=count, help='rows of %s sheet (default: %s)' % (name, count))
+   parser.add_argument('-w', dest='width', type=int, default=8, help='nested-block columns added to scaled sheets (default: 8)')
+   parser.add_argument('-r', dest='reader', choices=['openpyxl', 'calamine', 'auto'], default=transform.defaultoptions['reader'], help='xlsx reader for packed sheets (default: ' + transform.defaultoptions['reader'] + ')')
+   parser.add_argument('-l', dest='limit', type=int, default=None, help='fail if packed sheets take more bytes per 100k cells')
+   results = parser.parse_args()
+
+   counts = dict((name, getattr(results, name)) for name in throughput.scaledsheets)
+
+   context = multiprocessing.get_context('spawn')
+
+   failed = False
+
+   with tempfile.TemporaryDirectory() as tempfolder:
+      datapath = os.path.join(tempfolder, 'data')
+      sizes = throughput.genworkbooks(results.inputfolder, datapath, counts, results.width)
+      propnames = sorted(sizes)
+
+      print('%-16s %12s %12s %16s' % ('sheets', 'cells', 'MB', 'bytes/100k cells'))
+      for kind in ['dataframe', 'packed']:
+         with context.Pool(1) as pool:
+            result = pool.apply(measure, ((kind, datapath, propnames, results.reader),))
+         perhundredk = result['bytes'] * 100000 // max(result['cells'], 1)
+         print('%-16s %12d %12.1f %16d' % (kind, result['cells'], result['bytes'] / 1048576, perhundredk))
+         if kind == 'packed' and results.limit != None and perhundredk > results.limit:
+            print('Packed sheets above %s bytes per 100k cells' % results.limit)
+            failed = True
+
+   if failed:
+      sys.exit(1)
+
+   return
+
+if __name__ == '__main__':
+   main()
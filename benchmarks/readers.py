@@ -0,0 +1,112 @@
+# Benchmark xlsx reader backends
+#
+# Copyright IBM Corporation 2021
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Scales up the example workbooks by repeating the data rows of each sheet
+# and reports the parse time of each reader backend.
+#
+# Usage: python benchmarks/readers.py [-s SCALE] [-n REPEAT] [input folder]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+import openpyxl
+import pandas as pd
+import transform
+
+exampledata = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'vpcwebapp', 'xlsx')
+
+# Write copy of workbook with data rows of every sheet repeated scale times.
+def scaleworkbook(source, target, scale):
+   book = openpyxl.load_workbook(source, read_only=True, data_only=True)
+   scaled = openpyxl.Workbook(write_only=True)
+
+   for worksheet in book.worksheets:
+      rows = list(worksheet.iter_rows(values_only=True))
+      sheet = scaled.create_sheet(worksheet.title)
+      if len(rows) == 0:
+         continue
+      sheet.append(rows[0])
+      for count in range(scale):
+         for row in rows[1:]:
+            sheet.append(row)
+
+   scaled.save(target)
+   book.close()
+
+   return
+
+# Parse all sheets of workbook with reader.
+def parse(reader, propfile):
+   if reader == 'legacy':
+      sheets = pd.read_excel(propfile, sheet_name=None, dtype=object, header=0)
+      return sum(sheet.size for sheet in sheets.values())
+
+   options = dict(transform.defaultoptions)
+   options['propfile'] = propfile
+   options['propext'] = 'xlsx'
+   options['reader'] = reader
+
+   cells = 0
+   book = transform.loadfile(options)
+   for name in book['names']:
+      cells += transform.sheetsize(transform.loadsheet(options, book, name))
+   transform.closefile(book)
+
+   return cells
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmark xlsx reader backends')
+   parser.add_argument('inputfolder', nargs='?', default=exampledata, help='folder with xlsx workbooks (default: examples/vpcwebapp/xlsx)')
+   parser.add_argument('-s', dest='scale', type=int, default=100, help='repeat data rows this many times (default: 100)')
+   parser.add_argument('-n', dest='repeat', type=int, default=3, help='best of this many runs (default: 3)')
+   results = parser.parse_args()
+
+   readers = ['legacy', 'openpyxl']
+   try:
+      import python_calamine
+      readers.append('calamine')
+   except ImportError:
+      print('calamine not installed, skipping')
+
+   with tempfile.TemporaryDirectory() as tempfolder:
+      workbooks = []
+      for afile in sorted(os.listdir(results.inputfolder)):
+         if afile.endswith('.xlsx'):
+            target = os.path.join(tempfolder, afile)
+            scaleworkbook(os.path.join(results.inputfolder, afile), target, results.scale)
+            workbooks.append(target)
+
+      print('%-16s %12s %12s %12s' % ('reader', 'cells', 'seconds', 'cells/s'))
+      for reader in readers:
+         best = None
+         for count in range(results.repeat):
+            start = time.perf_counter()
+            cells = 0
+            for workbook in workbooks:
+               cells += parse(reader, workbook)
+            elapsed = time.perf_counter() - start
+            if best == None or elapsed < best:
+               best = elapsed
+         print('%-16s %12d %12.3f %12.0f' % (reader, cells, best, cells / best))
+
+   return
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,78 @@
+# Benchmark transform command line startup
+#
+# Copyright IBM Corporation 2021
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Times --version and --help of the transform command and fails if the best
+# run is above the target latency, or if importing transform loads pandas.
+#
+# Usage: python benchmarks/startup.py [-l SECONDS] [-n REPEAT] [command]
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+sourcepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source')
+
+# Modules only imported when input is read.
+heavymodules = ['pandas', 'numpy', 'openpyxl', 'python_calamine', 'yaml']
+
+def timecommand(command, repeat):
+   best = None
+   for count in range(repeat):
+      start = time.perf_counter()
+      subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+      elapsed = time.perf_counter() - start
+      if best == None or elapsed < best:
+         best = elapsed
+
+   return best
+
+# Heavy modules loaded by importing transform.
+def importedmodules():
+   script = 'import sys; sys.path.insert(0, %r); import transform; print(" ".join(name for name in %r if name in sys.modules))' % (sourcepath, heavymodules)
+   output = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, check=True).stdout
+
+   return output.decode('utf-8').split()
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmark transform command line startup')
+   parser.add_argument('command', nargs='*', default=[sys.executable, os.path.join(sourcepath, 'transform.py')], help='transform command (default: python source/transform.py)')
+   parser.add_argument('-l', dest='limit', type=float, default=0.3, help='target seconds for best run (default: 0.3)')
+   parser.add_argument('-n', dest='repeat', type=int, default=5, help='best of this many runs (default: 5)')
+   results = parser.parse_args()
+
+   failed = False
+
+   for argument in ['--version', '--help']:
+      best = timecommand(results.command + [argument], results.repeat)
+      status = 'ok'
+      if best > results.limit:
+         status = 'above %.3fs' % results.limit
+         failed = True
+      print('%-12s %8.3fs  %s' % (argument, best, status))
+
+   modules = importedmodules()
+   if len(modules) > 0:
+      print('import transform loads %s' % ', '.join(modules))
+      failed = True
+
+   if failed:
+      sys.exit(1)
+
+   return
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,306 @@
+# Benchmark transform throughput on synthetic workbooks
+#
+# Copyright IBM Corporation 2021
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Generates synthetic workbooks modeled on the example workbooks with the
+# given number of rows for the large sheets, then reports rows/s, cells/s,
+# bytes/s and peak RSS of gentf() end to end and of each generator.
+# Every measurement runs in a new process so peak RSS is its own.
+#
+# Usage: python benchmarks/throughput.py [-o results.json] [-c baseline.json]
+#
+# With -c the run fails if any rows/s result is more than -l percent below
+# the baseline results, so regressions between releases show up in CI.
+
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+
+sourcepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source')
+sys.path.insert(0, sourcepath)
+
+import openpyxl
+import transform
+
+exampledata = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'vpcwebapp')
+
+# Sheets scaled to a row count, with the default count.
+scaledsheets = {
+'vpcs': 10,
+'subnets': 300,
+'instances': 1000,
+'sgrules': 5000,
+'aclrules': 5000,
+'lbpools': 200
+}
+
+# Generators timed one at a time.
+generators = ['genvariables', 'genoutputs', 'gencloudinits', 'genmodules', 'genproviders', 'genversions', 'genaclresources', 'genresources']
+
+# Write copy of example workbooks with rows of scaled sheets repeated up to
+# the requested count and width nested-block columns added to them.
+# Returns rows and cells of every sheet by workbook.
+def genworkbooks(inputfolder, datapath, counts, width):
+   os.makedirs(os.path.join(datapath, 'xlsx'))
+   if os.path.isdir(os.path.join(inputfolder, 'cloudinits')):
+      shutil.copytree(os.path.join(inputfolder, 'cloudinits'), os.path.join(datapath, 'cloudinits'))
+
+   sizes = {}
+   for afile in sorted(os.listdir(os.path.join(inputfolder, 'xlsx'))):
+      if not afile.endswith('.xlsx'):
+         continue
+      book = openpyxl.load_workbook(os.path.join(inputfolder, 'xlsx', afile), read_only=True, data_only=True)
+      scaled = openpyxl.Workbook(write_only=True)
+
+      propname = os.path.splitext(afile)[0]
+      sizes[propname] = {}
+      for worksheet in book.worksheets:
+         rows = list(worksheet.iter_rows(values_only=True))
+         sheet = scaled.create_sheet(worksheet.title)
+         if len(rows) == 0:
+            continue
+
+         header = list(rows[0])
+         while len(header) > 0 and header[-1] == None:
+            header.pop()
+         data = [list(row[0:len(header)]) + [None] * (len(header) - len(row)) for row in rows[1:] if any(cell != None for cell in row)]
+
+         name = worksheet.title.replace(' ', '')
+         if name in scaledsheets and len(data) > 0:
+            # Nested-block columns go before the module and comments columns.
+            extra = ['block%s.value%s' % (column // 4, column % 4) for column in range(width)]
+            header = header[0:-2] + extra + header[-2:]
+            namecolumn = header.index('*name') if '*name' in header else None
+            template = data
+            data = []
+            for count in range(counts[name]):
+               row = list(template[count % len(template)])
+               if namecolumn != None and count >= len(template):
+                  row[namecolumn] = '%s-%s' % (row[namecolumn], count // len(template))
+               data.append(row[0:-2] + ['value%s' % column for column in range(width)] + row[-2:])
+
+         sheet.append(header)
+         for row in data:
+            sheet.append(row)
+         sizes[propname][name] = (len(data), len(data) * len(header))
+
+      scaled.save(os.path.join(datapath, 'xlsx', afile))
+      book.close()
+
+   return sizes
+
+def newjob(datapath, genpath, propname, reader):
+   job = dict(transform.defaultoptions)
+   job['reader'] = reader
+   job['datapath'] = datapath
+   job['genpath'] = genpath
+   job['propfile'] = os.path.join(datapath, 'xlsx', propname + '.xlsx')
+   job['propname'] = propname
+   job['propext'] = 'xlsx'
+   job['writer'] = transform.newwriter()
+
+   return job
+
+def peakrss():
+   peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   # Linux reports kilobytes, macOS bytes.
+   if sys.platform != 'darwin':
+      peak *= 1024
+
+   return peak
+
+def outputbytes(genpath):
+   total = 0
+   for folder, dirs, files in os.walk(genpath):
+      for afile in files:
+         total += os.path.getsize(os.path.join(folder, afile))
+
+   return total
+
+# Bytes of lines and copied files recorded by deferred writer.
+def deferredbytes(writer):
+   total = writer['size']
+   for entry in writer['deferred']:
+      if entry[0] == 'lines':
+         for lines in entry[1].values():
+            total += sum(len(line) + 1 for line in lines)
+      else:
+         total += os.path.getsize(entry[1])
+
+   return total
+
+# Run gentf() on all workbooks into a new output folder.
+def measuregentf(datapath, propnames, reader):
+   genpath = tempfile.mkdtemp(prefix='resources', dir=datapath)
+
+   stdout = sys.stdout
+   sys.stdout = io.StringIO()
+   try:
+      start = time.perf_counter()
+      for propname in propnames:
+         transform.gentf(newjob(datapath, genpath, propname, reader))
+      elapsed = time.perf_counter() - start
+   finally:
+      sys.stdout = stdout
+
+   return {'seconds': elapsed, 'bytes': outputbytes(genpath), 'rss': peakrss()}
+
+# Run one generator on all sheets it handles, with sheets loaded up front
+# and output kept in a deferred writer so only the generator is timed.
+def measuregenerator(datapath, propnames, reader, generator):
+   elapsed = 0.0
+   written = 0
+   sheets = []
+
+   function = getattr(transform, generator)
+   calls = []
+   def timed(options, name, table):
+      calls.append(name)
+      start = time.perf_counter()
+      function(options, name, table)
+      calls.append(time.perf_counter() - start)
+   setattr(transform, generator, timed)
+   # Sheet types dispatch through a table of generators.
+   sheettypes = [sheettype for sheettype, candidate in transform.sheetgenerators.items() if candidate == function]
+   for sheettype in sheettypes:
+      transform.sheetgenerators[sheettype] = timed
+
+   stdout = sys.stdout
+   sys.stdout = io.StringIO()
+   try:
+      for propname in propnames:
+         job = newjob(datapath, os.path.join(datapath, 'resources'), propname, reader)
+         job['writer'] = transform.newwriter(True)
+         for name, sheet, df in transform.loadframes(job):
+            name = name.replace(' ', '')
+            del calls[:]
+            transform.gensheet(job, name, transform.sheettable(df))
+            if len(calls) > 0:
+               elapsed += calls[1]
+               sheets.append([propname, name])
+         written += deferredbytes(job['writer'])
+   finally:
+      sys.stdout = stdout
+      setattr(transform, generator, function)
+      for sheettype in sheettypes:
+         transform.sheetgenerators[sheettype] = function
+
+   return {'seconds': elapsed, 'bytes': written, 'rss': peakrss(), 'sheets': sheets}
+
+def measure(arguments):
+   kind, datapath, propnames, reader = arguments
+   if kind == 'gentf':
+      return measuregentf(datapath, propnames, reader)
+   else:
+      return measuregenerator(datapath, propnames, reader, kind)
+
+def rates(result, rows, cells):
+   seconds = max(result['seconds'], 1e-9)
+   return {
+   'rows': rows,
+   'cells': cells,
+   'bytes': result['bytes'],
+   'seconds': round(result['seconds'], 6),
+   'rows_per_second': round(rows / seconds, 1),
+   'cells_per_second': round(cells / seconds, 1),
+   'bytes_per_second': round(result['bytes'] / seconds, 1),
+   'peak_rss': result['rss']
+   }
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmark transform throughput on synthetic workbooks')
+   parser.add_argument('inputfolder', nargs='?', default=exampledata, help='data folder with xlsx workbooks to model (default: examples/vpcwebapp)')
+   for name, count in scaledsheets.items():
+      parser.add_argument('--' + name, type=int, dest=name, default=count, help='rows of %s sheet (default: %s)' % (name, count))
+   parser.add_argument('-w', dest='width', type=int, default=8, help='nested-block columns added to scaled sheets (default: 8)')
+   parser.add_argument('-r', dest='reader', choices=['openpyxl', 'calamine', 'auto', 'pandas'], default=transform.defaultoptions['reader'], help='xlsx reader (default: ' + transform.defaultoptions['reader'] + ')')
+   parser.add_argument('-n', dest='repeat', type=int, default=3, help='best of this many runs (default: 3)')
+   parser.add_argument('-o', dest='output', default=None, help='write results to JSON file')
+   parser.add_argument('-c', dest='baseline', default=None, help='compare with results in JSON file')
+   parser.add_argument('-l', dest='limit', type=float, default=10.0, help='allowed percent below baseline rows/s (default: 10)')
+   results = parser.parse_args()
+
+   counts = dict((name, getattr(results, name)) for name in scaledsheets)
+
+   # Spawned processes start without the parent's memory.
+   context = multiprocessing.get_context('spawn')
+
+   report = {
+   'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+   'python': platform.python_version(),
+   'platform': platform.platform(),
+   'parameters': {'counts': counts, 'width': results.width, 'reader': results.reader},
+   'results': {}
+   }
+
+   with tempfile.TemporaryDirectory() as tempfolder:
+      datapath = os.path.join(tempfolder, 'data')
+      sizes = genworkbooks(results.inputfolder, datapath, counts, results.width)
+      propnames = sorted(sizes)
+
+      print('%-16s %10s %12s %12s %12s %12s %10s' % ('benchmark', 'rows', 'seconds', 'rows/s', 'cells/s', 'bytes/s', 'rss MB'))
+      for kind in ['gentf'] + generators:
+         best = None
+         for count in range(results.repeat):
+            with context.Pool(1) as pool:
+               result = pool.apply(measure, ((kind, datapath, propnames, results.reader),))
+            if best == None or result['seconds'] < best['seconds']:
+               best = result
+
+         if kind == 'gentf':
+            included = [(propname, name) for propname in propnames for name in sizes[propname]]
+         else:
+            included = [tuple(sheet) for sheet in best['sheets']]
+         rows = sum(sizes[propname][name][0] for propname, name in included)
+         cells = sum(sizes[propname][name][1] for propname, name in included)
+
+         entry = rates(best, rows, cells)
+         report['results'][kind] = entry
+         print('%-16s %10d %12.3f %12.0f %12.0f %12.0f %10.1f' % (kind, rows, entry['seconds'], entry['rows_per_second'], entry['cells_per_second'], entry['bytes_per_second'], entry['peak_rss'] / 1048576))
+
+   if results.output != None:
+      with open(results.output, 'w') as f:
+         json.dump(report, f, indent=2)
+
+   failed = False
+   if results.baseline != None:
+      with open(results.baseline, 'r') as f:
+         baseline = json.load(f)
+      if baseline['parameters'] != report['parameters']:
+         print('Baseline %s has different parameters, not compared' % results.baseline)
+         baseline['results'] = {}
+      for kind, entry in report['results'].items():
+         previous = baseline['results'].get(kind)
+         if previous == None or previous['rows_per_second'] == 0:
+            continue
+         change = (entry['rows_per_second'] / previous['rows_per_second'] - 1) * 100
+         if change < -results.limit:
+            print('Regression in %s: %.1f%% rows/s' % (kind, change))
+            failed = True
+
+   if failed:
+      sys.exit(1)
+
+   return
+
+if __name__ == '__main__':
+   main()
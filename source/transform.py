@@ -13,14 +13,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import os
 import sys
 import argparse
+import csv
+import hashlib
+import locale
+import pickle
+import re
+import time
+import threading
+import multiprocessing
 import json
-import yaml
 import shutil
-import numpy as np
-import pandas as pd
+
+# pandas and modules used only with some options are imported where used
+# so --version and --help start without loading them.
 
 # Constants
 
@@ -29,8 +38,17 @@ COPYRIGHT = 'tabular-terraform 1.19.0.0 - Copyright IBM Corporation 2021'
 
 genheader = '# Generated by tabular-terraform'
 
+# Incremental regeneration manifest kept in the output folder.
+manifestname = '.tabular-terraform.json'
+
+# Addresses of resources compacted with --compact kept in the output folder
+# to move resources between modes.
+movedname = '.tabular-terraform.moved.json'
+movedfile = 'moved.tf'
+
 dataheader = 'data "%s" "%s" {'
 moduleheader = 'module "%s" {'
+movedheader = 'moved {'
 outputheader = 'output "%s" {'
 providerheader = 'provider "%s" {'
 resourceheader = 'resource "%s" "%s" {'
@@ -39,12 +57,18 @@ variableheader = 'variable "%s" {'
 
 enddata = '}'
 endmodule = '}'
+endmoved = '}'
 endoutput = '}'
 endprovider = '}'
 endresource = '}'
 endterraform = '}'
 endvariable = '}'
 
+# Nested blocks with special headers in versions sheets.
+versionblocks = {
+'required_providers.ibm': ['required_providers {', 'ibm = {']
+}
+
 # Messages
 
 toolheader = 'Transform tabularized Terraform data into Terraform resources\n'
@@ -53,6 +77,8 @@ startprovidermessage = 'Generating Resource for provider\n'
 startversionsmessage = 'Generating Resource for versions\n'
 donetfmessage = '\nCompleted Resources for %s with output to folder %s\n'
 backupdirectorymessage = 'Backed up existing output directory %s to %s\n'
+archivedbackupmessage = 'Archived backup %s to %s'
+removedbackupmessage = 'Removed backup %s'
 invalidinputdirectorymessage = '(Error) Invalid input directory: %s'
 invalidinputfilemessage = '(Error) Invalid input file: %s'
 invalidprotocolmessage = '(Error) Invalid protocol: %s'
@@ -60,26 +86,85 @@ invalidgatewayspecmessage = '(Error) Invalid gateway specification: %s'
 invalidnicmessage = '(Error) Invalid nic: %s'
 invalidsecondarynicmessage = '(Error) Invalid secondary nic: %s'
 missinginputmessage = '(Error) No input files found: %s'
+missingarchivermessage = '(Error) Archive format %s not available, using tar.gz'
+missingreadermessage = '(Error) Reader %s not available, using openpyxl'
 missingimagemessage = '(Error) Image %s not found'
 missingzonemessage = '(Error) Zone %s not found'
 missingsubnetmessage = '(Error) Subnet for %s not found'
 missingimageprofilemessage = '(Error) Image profile %s not found'
 missingvolumeprofilemessage = '(Error) Volume profile %s not found'
+missingcloudinitmessage = '(Error) Cloudinit %s not found, row %s'
+missingcolumnmessage = '(Error) Required column %s missing in sheet %s'
+unresolvedreferencemessage = '(Error) Unresolved reference %s in %s sheet %s row %s'
+uncheckedoutputmessage = '(Error) %s unresolved references, no output written'
+invalidstatsfilemessage = '(Error) Invalid statistics file: %s'
+invalidschemamessage = '(Error) Invalid schema file: %s'
+unknownattributemessage = '(Error) Unknown attribute %s of %s in %s sheet %s column %s'
+readonlyattributemessage = '(Error) Read-only attribute %s of %s in %s sheet %s column %s'
+invalidcolumnsmessage = '(Error) %s invalid columns, no output written'
+missingschemamessage = 'No schema for %s, not checking sheet %s'
+compactedsheetmessage = 'Compacted %s rows of %s into %s for_each resources'
 missingvaluemessage = '(Error) Required value missing on column %s, row %s'
 processingsheetmessage = 'Processing %s'
-
-# User options
-
-options = {
+reusingsheetmessage = 'Reusing %s'
+cachedinputmessage = 'Loaded %s from cache'
+trimmedsheetmessage = 'Dropped %s empty rows and %s empty columns from %s'
+unchangedinputmessage = 'Unchanged input %s'
+updatedoutputmessage = 'Updated %s of %s output files in %s, removed %s'
+savedstatsmessage = 'Saved statistics to %s'
+savedprofilemessage = 'Saved profile to %s'
+
+# Default options
+
+# Options of a run are a copy of the defaults updated from the command line
+# or the arguments of transform().
+defaultoptions = {
 'generation': '2',
 'datapath': 'data',
 'datatype': 'xlsx',
 'genpath': 'resources',
 'propext': 'xlsx',
 'propfile': '',
-'propname': '*'
+'propname': '*',
+'buffersize': 16777216,
+'jobs': 1,
+'incremental': False,
+'reader': 'openpyxl',
+'verbose': False,
+'cachepath': None,
+'cachesize': 512,
+'cacheage': 30,
+'stream': False,
+'check': False,
+'schema': None,
+'compact': False,
+'staging': 'copy',
+'cloudinits': 'copy',
+'update': False,
+'archive': 'none',
+'keepbackups': 0,
+'keepdays': 0,
+'stats': None,
+'statspath': None,
+'profile': None,
+'log': None
 }
 
+# Input types
+
+# Spreadsheet workbooks.
+spreadsheettypes = ['xls', 'xlsx']
+
+# Table files with one sheet per file, or JSON with sheets by name.
+# A folder of table files is read as one workbook.
+tabletypes = ['csv', 'tsv', 'json', 'jsonl']
+
+# Columns that end every sheet, after the attribute columns.
+trailingcolumns = ['module', 'comments']
+
+# Optional file in folder of table files with sheet names in order.
+sheetorder = 'sheets.txt'
+
 # Resource names
 
 # Translate sheet names to resource names.
@@ -128,341 +213,1847 @@ resources = {
 
 # Utility functions
 
-# isna returns True for NA values such as None or numpy.NaN.
-# isna returns False for empty strings or numpy.inf unless
-# set pandas.options.mode.use_inf_as_na = True
-# Note:
-# Empty spreadsheet values start out as NaN but if a value is
-# added and later deleted then the value can be an empty string.
-# Checking pd.isna here doesn't work as value is 'nan'.
-def novalue(value):
-   empty = pd.isna(value)
-   if empty:
-      return True
-   if type(value) == str:
-      value = value.replace(' ', '')
-      if value == '':
-         return True
-   if isinstance(value, str):
-      value = value.replace(' ', '')
-      if value == '':
-         return True
+# Messages go to options['log'], standard output by default, so runs in
+# threads or pool workers can keep their messages apart.
+def printmessage(options, message, end='\n'):
+   log = options['log']
+   if log == None:
+      log = sys.stdout
+
+   log.write(message + end)
+
+   return
+
+# Packed sheets
+
+# Parsed sheets are kept packed by column instead of as object DataFrames.
+# Cells of a column are codes into the distinct values of the column, with
+# equal strings shared so repeated zones, profiles and references are a
+# single object, and cells with a value are flagged in a bitmask so empty
+# cells take one bit instead of a NaN object.
+#   columns: column names
+#   length: number of rows
+#   values: distinct values of each column, NaN first
+#   codes: numpy array of codes into values for each column
+#   present: bits of cells with value, row by row, from numpy.packbits
+
+# Pack cells of one column. Strings in missing are read as NaN and equal
+# strings of all columns of the sheet are one object of strings.
+# Returns distinct values, codes and flags of distinct values that are
+# not empty. Strings of spaces are kept but are empty like NaN.
+def packcolumn(np, cells, missing, strings):
+   nan = float('nan')
+
+   values = [nan]
+   present = [False]
+   codes = {}
+   column = []
+   for value in cells:
+      # Equal values of different types such as 1 and True are kept apart.
+      key = (value.__class__, value)
+      code = codes.get(key)
+      if code == None:
+         if isinstance(value, float) and value != value:
+            code = 0
+         elif isinstance(value, str) and value in missing:
+            code = 0
+         else:
+            code = len(values)
+            if isinstance(value, str):
+               value = strings.setdefault(value, value)
+               present.append(value.replace(' ', '') != '')
+            else:
+               present.append(value is not None)
+            values.append(value)
+         codes[key] = code
+      column.append(code)
+
+   if len(values) <= 256:
+      dtype = np.uint8
+   elif len(values) <= 65536:
+      dtype = np.uint16
+   else:
+      dtype = np.uint32
+
+   return values, np.array(column, dtype=dtype), np.array(present, dtype=bool)
+
+# Pack sheet from cells of each column.
+def packcolumns(columns, cells, length, missing=()):
+   import numpy as np
+
+   sheet = {
+   'columns': list(columns),
+   'length': length,
+   'values': [],
+   'codes': [],
+   'present': None
+   }
+
+   strings = {}
+   mask = np.zeros((length, len(cells)), dtype=bool)
+   for columnindex in range(len(cells)):
+      values, codes, present = packcolumn(np, cells[columnindex], missing, strings)
+      sheet['values'].append(values)
+      sheet['codes'].append(codes)
+      mask[:, columnindex] = present[codes]
+   sheet['present'] = np.packbits(mask, axis=None)
+
+   return sheet
+
+# Pack DataFrame read by pandas.
+def packframe(df):
+   cells = [df.iloc[:, columnindex].tolist() for columnindex in range(df.columns.size)]
+
+   return packcolumns(df.columns, cells, len(df.index))
+
+# Row access for generators.
+# Rows are tuples of cell values and lists of mask flags addressed by
+# column position, built a column at a time from the packed sheet.
+def sheetrows(sheet):
+   import numpy as np
+
+   length = sheet['length']
+   width = len(sheet['columns'])
+
+   columns = []
+   for values, codes in zip(sheet['values'], sheet['codes']):
+      objects = np.empty(len(values), dtype=object)
+      objects[:] = values
+      columns.append(objects[codes].tolist())
+   if width > 0:
+      rows = zip(*columns)
+   else:
+      rows = [()] * length
+
+   present = np.unpackbits(sheet['present'], count=length * width).reshape(length, width).view(bool).tolist()
+
+   return zip(range(length), rows, present)
+
+# Table passed to generators with column names and rows from sheetrows
+# or streamrows.
+def sheettable(sheet):
+   table = {
+   'columns': sheet['columns'],
+   'rows': sheetrows(sheet)
+   }
+
+   return table
+
+# Number of cells of packed sheet.
+def sheetsize(sheet):
+   return sheet['length'] * len(sheet['columns'])
+
+# Input readers
+
+# Strings read as missing values, same as the pandas.read_excel defaults.
+navalues = {
+'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+'1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+'nan', 'null'
+}
+
+# Error values returned as strings by openpyxl in values only mode.
+errorvalues = {
+'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A'
+}
+
+# Convert cell value the same way as pandas.read_excel.
+# Empty cells are returned as empty string for trimming.
+def convertcell(value):
+   if value is None:
+      return ''
+   if type(value) is float and value.is_integer():
+      return int(value)
+   if type(value) is str and value in errorvalues:
+      return float('nan')
+
+   return value
+
+# Column names from header cells at columnindexes.
+# Empty names are replaced by position and duplicate names get a numeric
+# suffix, same as pandas.read_excel: named columns are renamed before
+# unnamed ones and suffixes already taken by a header name are skipped.
+def headercolumns(header, columnindexes):
+   columns = []
+   unnamed = []
+   for position, columnindex in enumerate(columnindexes):
+      column = header[columnindex]
+      if column == '':
+         column = 'Unnamed: %s' % columnindex
+         unnamed.append(position)
+      columns.append(column)
+
+   # Rename duplicate columns with numeric suffix.
+   counts = {}
+   unnamedpositions = set(unnamed)
+   order = [position for position in range(len(columns)) if not position in unnamedpositions] + unnamed
+   for position in order:
+      column = columns[position]
+      base = column
+      count = counts.get(column, 0)
+      if count > 0:
+         while count > 0:
+            counts[base] = count + 1
+            column = '%s.%s' % (base, count)
+            if column in columns:
+               count += 1
+            else:
+               count = counts.get(column, 0)
+         columns[position] = column
+      counts[column] = count + 1
+
+   return columns
+
+# Build packed sheet from raw sheet rows with header in first row.
+# Spreadsheets can report a used range far beyond the data when empty cells
+# are formatted, so trailing empty cells are dropped from each raw row before
+# conversion and empty rows are only kept when followed by data. Columns
+# without a header and without data are dropped. Otherwise the cells are
+# the same as read by pandas.read_excel(dtype=object, header=0).
+def framerows(options, name, rows):
+   data = []
+   blankrows = 0
+   rawwidth = 0
+   for row in rows:
+      last = len(row)
+      if last > rawwidth:
+         rawwidth = last
+      while last > 0 and (row[last-1] is None or row[last-1] == ''):
+         last -= 1
+      if last == 0:
+         blankrows += 1
+         continue
+      while blankrows > 0:
+         data.append([])
+         blankrows -= 1
+      converted = [convertcell(value) for value in row[0:last]]
+      while converted[-1] == '':
+         converted.pop()
+      data.append(converted)
+
+   if len(data) == 0:
+      return packcolumns([], [], 0)
+
+   width = max(len(row) for row in data)
+
+   header = data[0] + [''] * (width - len(data[0]))
+
+   # Cells by column, strings read as missing values are packed as NaN.
+   length = len(data) - 1
+   cells = [[] for columnindex in range(width)]
+   for row in data[1:]:
+      for columnindex in range(len(row)):
+         cells[columnindex].append(row[columnindex])
+      for columnindex in range(len(row), width):
+         cells[columnindex].append('')
+
+   # Keep columns with header or data.
+   keep = []
+   for columnindex in range(width):
+      if header[columnindex] != '':
+         keep.append(columnindex)
+         continue
+      for value in cells[columnindex]:
+         if not (type(value) is float and value != value) and not (type(value) is str and value in navalues):
+            keep.append(columnindex)
+            break
+
+   sheet = packcolumns(headercolumns(header, keep), [cells[columnindex] for columnindex in keep], length, navalues)
+
+   if options['verbose']:
+      droppedrows = blankrows
+      droppedcolumns = rawwidth - len(keep)
+      if droppedrows > 0 or droppedcolumns > 0:
+         printmessage(options, trimmedsheetmessage % (droppedrows, droppedcolumns, name))
+
+   return sheet
+
+# Build table streaming rows from raw sheet rows with header in first row.
+# Only the current row is held in memory. Columns are given by the header
+# row, cells beyond the last header cell are ignored.
+def streamtable(options, name, rows):
+   rows = iter(rows)
+
+   header = []
+   for row in rows:
+      header = [convertcell(value) for value in row]
+      break
+   while len(header) > 0 and header[-1] == '':
+      header.pop()
+
+   columns = headercolumns(header, range(len(header)))
+   # Remove leading asterisk from column names
+   columns = [column[1:] if column[0] == '*' else column for column in columns]
+
+   table = {
+   'columns': columns,
+   'rows': streamrows(options, name, rows, len(columns))
+   }
+
+   return table
+
+# Stream row index, row values and row mask from raw sheet rows.
+# Empty rows are only passed on when followed by data.
+def streamrows(options, name, rows, width):
+   nan = float('nan')
+
+   rowindex = 0
+   blankrows = 0
+   for row in rows:
+      last = min(len(row), width)
+      while last > 0 and (row[last-1] is None or row[last-1] == ''):
+         last -= 1
+      if last == 0:
+         blankrows += 1
+         continue
+      while blankrows > 0:
+         yield rowindex, [nan] * width, [False] * width
+         rowindex += 1
+         blankrows -= 1
+
+      values = [nan] * width
+      present = [False] * width
+      for columnindex in range(last):
+         value = convertcell(row[columnindex])
+         if type(value) is str:
+            if value in navalues:
+               continue
+            present[columnindex] = value.replace(' ', '') != ''
+         else:
+            present[columnindex] = not (type(value) is float and value != value)
+         values[columnindex] = value
+
+      yield rowindex, values, present
+      rowindex += 1
+
+   if options['verbose'] and blankrows > 0:
+      printmessage(options, trimmedsheetmessage % (blankrows, 0, name))
+
+   return
+
+# Select reader for xlsx files.
+# auto uses calamine if installed and otherwise openpyxl.
+def selectreader(options):
+   reader = options['reader']
+
+   if options['propext'].lower() == 'xls':
+      # Legacy xls is only supported by pandas.
+      return 'pandas'
+
+   if reader == 'auto' or reader == 'calamine':
+      try:
+         import python_calamine
+         return 'calamine'
+      except ImportError:
+         if reader == 'calamine':
+            printmessage(options, missingreadermessage % reader)
+
+      return 'openpyxl'
+
+   return reader
+
+# Find tables of workbook by sheet name.
+# Values are file names of tables or tables already read from JSON.
+# Sheets of a folder are in file name order unless listed in sheetorder file.
+def loadtables(propfile):
+   tables = {}
+
+   if os.path.isdir(propfile):
+      afiles = sorted(os.listdir(propfile))
+      orderfile = os.path.join(propfile, sheetorder)
+      if os.path.isfile(orderfile):
+         with open(orderfile, 'r', encoding='utf-8-sig') as f:
+            names = [line.strip() for line in f if line.strip() != '']
+         ordered = []
+         for name in names:
+            for afile in afiles:
+               if os.path.splitext(afile)[0] == name and not afile in ordered:
+                  ordered.append(afile)
+         afiles = ordered + [afile for afile in afiles if not afile in ordered]
+      pathnames = [os.path.join(propfile, afile) for afile in afiles]
+   else:
+      pathnames = [propfile]
+
+   for pathname in pathnames:
+      sheetname, tabletype = os.path.splitext(os.path.basename(pathname))
+      tabletype = tabletype[1:].lower()
+      if not tabletype in tabletypes or not os.path.isfile(pathname):
+         continue
+      if tabletype == 'json':
+         with open(pathname, 'r', encoding='utf-8-sig') as f:
+            table = json.load(f)
+         if isinstance(table, dict):
+            # JSON object with sheets by name.
+            for name, sheet in table.items():
+               tables[name] = sheet
+         else:
+            tables[sheetname] = table
       else:
-         return False
+         tables[sheetname] = pathname
+
+   return tables
+
+# Stream rows of JSONL file one line at a time.
+def jsonlines(pathname):
+   with open(pathname, 'r', encoding='utf-8-sig') as f:
+      for line in f:
+         if line.strip() != '':
+            yield json.loads(line)
+
+   return
+
+# Stream raw rows of table with header in first row.
+# Tables are CSV, TSV or JSONL files, or JSON arrays of rows. Rows are lists
+# of values or objects with column names as keys. JSONL files are read again
+# for each pass over the rows so only one row is held at a time.
+def readtable(table):
+   if isinstance(table, str):
+      tabletype = os.path.splitext(table)[1][1:].lower()
+      if tabletype == 'jsonl':
+         rows = lambda: jsonlines(table)
+      else:
+         delimiter = '\t' if tabletype == 'tsv' else ','
+         with open(table, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.reader(f, delimiter=delimiter):
+               yield row
+         return
    else:
-      return False
+      rows = lambda: (row for row in table)
+
+   first = rows()
+   row = next(first, None)
+   first.close()
+
+   if row == None or not isinstance(row, dict):
+      for row in rows():
+         yield row
+      return
 
+   # Rows can leave out keys, e.g. of empty cells, so a key first seen in
+   # a later row goes after the key before it in that row rather than last.
+   # Module and comments columns are kept after the attribute columns.
+   columns = []
+   seen = set()
+   for row in rows():
+      if all(column in seen for column in row):
+         continue
+      position = 0
+      for column in row:
+         if column in seen:
+            position = columns.index(column) + 1
+         else:
+            columns.insert(position, column)
+            seen.add(column)
+            position += 1
+   for trailing in trailingcolumns:
+      for column in [column for column in columns if isinstance(column, str) and column.lstrip('*') == trailing]:
+         columns.remove(column)
+         columns.append(column)
+
+   yield columns
+   for row in rows():
+      yield [row.get(column) for column in columns]
+
+   return
+
+# Stream raw rows of calamine sheet.
+# Rows start at the first used column so they are padded to start at
+# column A as rows read by openpyxl do.
+def calaminerows(worksheet):
+   padding = [''] * worksheet.start[1] if worksheet.start != None else []
+
+   for row in worksheet.iter_rows():
+      yield padding + row
+
+   return
+
+# Open workbook without loading sheets.
+# Sheets are loaded on demand by loadsheet.
 def loadfile(options):
    propext = options['propext']
    propfile = options['propfile']
 
    if (propext.lower() == 'xls' or propext.lower() == 'xlsx'):
-      sheets = pd.read_excel(propfile, sheet_name=None, dtype=object, header=0)
+      reader = selectreader(options)
+      if reader == 'openpyxl':
+         import openpyxl
+         workbook = openpyxl.load_workbook(propfile, read_only=True, data_only=True, keep_links=False)
+         book = {'reader': reader, 'workbook': workbook, 'names': workbook.sheetnames}
+      elif reader == 'calamine':
+         import python_calamine
+         workbook = python_calamine.CalamineWorkbook.from_path(propfile)
+         book = {'reader': reader, 'workbook': workbook, 'names': workbook.sheet_names}
+      else:
+         import pandas as pd
+         sheets = pd.read_excel(propfile, sheet_name=None, dtype=object, header=0)
+         book = {'reader': reader, 'workbook': sheets, 'names': list(sheets.keys())}
+   elif propext.lower() in tabletypes:
+      tables = loadtables(propfile)
+      book = {'reader': 'table', 'workbook': tables, 'names': list(tables.keys())}
    else:
-      print(invalidinputfilemessage % propfile)
-      sheets = None
+      printmessage(options, invalidinputfilemessage % propfile)
+      book = None
+
+   return book
+
+# Stream raw rows of sheet.
+def sheetdata(book, name):
+   workbook = book['workbook']
+
+   if book['reader'] == 'openpyxl':
+      worksheet = workbook[name]
+      # Dimensions saved by some tools are wrong so scan all cells.
+      worksheet.reset_dimensions()
+      return worksheet.iter_rows(values_only=True)
+
+   if book['reader'] == 'table':
+      return readtable(workbook[name])
+
+   return calaminerows(workbook.get_sheet_by_name(name))
+
+def loadsheet(options, book, name):
+   if book['reader'] == 'pandas':
+      # Sheets read by pandas are released once packed.
+      return packframe(book['workbook'].pop(name))
+
+   return framerows(options, name, sheetdata(book, name))
 
-   return sheets
+def closefile(book):
+   if book['reader'] == 'openpyxl':
+      book['workbook'].close()
 
-def loadframe(options, pd, sheet):
+   return
+
+# Packed sheet with normalized column names sharing the cells of sheet.
+def loadframe(options, sheet):
    propext = options['propext']
    propfile = options['propfile']
 
-   df = pd.DataFrame(sheet)
+   frame = dict(sheet)
 
-   if (propext.lower() == 'xls' or propext.lower() == 'xlsx'):
+   if propext.lower() in spreadsheettypes or propext.lower() in tabletypes:
       # Remove leading asterisk from column names
-      df.rename(columns=lambda x: x[1:] if x[0]=='*' else x, inplace=True)
+      frame['columns'] = [x[1:] if x[0]=='*' else x for x in sheet['columns']]
    else:
-      print(invalidinputfilemessage % propfile)
+      printmessage(options, invalidinputfilemessage % propfile)
       sheets = None
 
-   return df
+   return frame
+
+# Load sheets of workbook one at a time.
+# Yields sheet name, sheet as read and packed sheet with normalized
+# column names.
+def loadframes(options):
+   start = time.perf_counter()
+   # Sheets kept by the reference check.
+   frames = options.get('frames')
+   if frames == None:
+      frames = loadcache(options)
+   if frames != None:
+      recordworkbook(options, start)
+      for name, frame in frames:
+         recordsheet(options, name, time.perf_counter())
+         yield name, frame, frame
+      return
+
+   book = loadfile(options)
+   recordworkbook(options, start)
+   if book == None:
+      return
+
+   frames = []
+   for name in book['names']:
+      start = time.perf_counter()
+      sheet = loadsheet(options, book, name)
+      frame = loadframe(options, sheet)
+      recordsheet(options, name, start)
+      if options['cachepath'] != None:
+         frames.append((name, frame))
+      yield name, sheet, frame
+
+   closefile(book)
+
+   if options['cachepath'] != None:
+      savecache(options, frames)
+
+   return
+
+# Load sheets of workbook one at a time as streaming tables.
+# Sheets read by pandas are already in memory and are not streamed.
+def streamsheets(options):
+   start = time.perf_counter()
+   book = loadfile(options)
+   recordworkbook(options, start)
+   if book == None:
+      return
+
+   for name in book['names']:
+      start = time.perf_counter()
+      if book['reader'] == 'pandas':
+         frame = loadframe(options, loadsheet(options, book, name))
+         recordsheet(options, name, start)
+         yield name, sheettable(frame)
+      else:
+         # Rows are parsed while generating so parse time counts as generate time.
+         table = streamtable(options, name, sheetdata(book, name))
+         recordsheet(options, name, start)
+         yield name, table
+
+   closefile(book)
+
+   return
+
+# Parsed workbook cache
+
+# Packed sheets with normalized column names are pickled per workbook.
+# Cache entries are keyed by workbook path, size, modification time and
+# content so any change to the workbook misses the cache. Tool and numpy
+# versions are part of the key as pickles are version specific.
+def cachefile(options):
+   import numpy as np
+
+   propfile = options['propfile']
+
+   status = os.stat(propfile)
+   key = '%s|%s|%s|%s|%s|%s|%s' % (COPYRIGHT, np.__version__, selectreader(options), os.path.abspath(propfile), status.st_size, status.st_mtime_ns, hashfile(propfile))
+
+   return os.path.join(options['cachepath'], hashlib.sha256(key.encode('utf-8')).hexdigest() + '.pickle')
+
+def loadcache(options):
+   if options['cachepath'] == None:
+      return None
+
+   pathname = cachefile(options)
+   if not os.path.isfile(pathname):
+      return None
+
+   try:
+      with open(pathname, 'rb') as f:
+         frames = pickle.load(f)
+   except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+      return None
+
+   # Modification time tracks last use for eviction.
+   os.utime(pathname)
+
+   if options['verbose']:
+      printmessage(options, cachedinputmessage % options['propfile'])
+
+   return frames
+
+def savecache(options, frames):
+   cachepath = options['cachepath']
+
+   if not os.path.exists(cachepath):
+      os.makedirs(cachepath, exist_ok=True)
+
+   pathname = cachefile(options)
+   temppath = '%s.%s.tmp' % (pathname, os.getpid())
+   with open(temppath, 'wb') as f:
+      pickle.dump(frames, f, protocol=pickle.HIGHEST_PROTOCOL)
+   os.replace(temppath, pathname)
+
+   return
+
+# Remove cache entries not used within cacheage days, then least recently
+# used entries until the cache is within cachesize megabytes.
+def evictcache(options):
+   cachepath = options['cachepath']
+
+   if cachepath == None or not os.path.isdir(cachepath):
+      return
+
+   entries = []
+   for afile in os.listdir(cachepath):
+      if afile.endswith('.pickle'):
+         pathname = os.path.join(cachepath, afile)
+         status = os.stat(pathname)
+         entries.append((status.st_mtime, status.st_size, pathname))
+   entries.sort()
+
+   expired = time.time() - options['cacheage'] * 86400
+   total = sum(entry[1] for entry in entries)
+   limit = options['cachesize'] * 1048576
+
+   for modified, size, pathname in entries:
+      if modified >= expired and total <= limit:
+         break
+      os.remove(pathname)
+      total -= size
+
+   return
+
+# Output writer
+
+# Generated lines are buffered in memory per output file and written with
+# a single open per file when the buffers are flushed at the end of each
+# workbook or when the buffered size reaches options['buffersize'].
+# A deferred writer records flushed buffers and file copies in order
+# instead of applying them so results can be merged by another process.
+def newwriter(deferred=False):
+   writer = {
+   'buffers': {},
+   'size': 0,
+   'dirs': set(),
+   'files': set(),
+   'copies': {},
+   'hashes': {},
+   'kept': set(),
+   'updatepath': None,
+   'outputpath': None,
+   'deferred': [] if deferred else None
+   }
+
+   return writer
 
 def printline(options, tfname, line):
-   genpath = options['genpath']
+   lines = outputlines(options, outputpath(options, tfname))
+
+   lines.append(line)
+
+   countlines(options, lines, len(lines) - 1)
+
+   return
+
+def outputpath(options, tfname):
+   return os.path.normpath(os.path.join(options['genpath'], tfname))
+
+# Buffered lines of output file for appending lines directly.
+# Appended lines are counted by countlines() before the next buffer lookup
+# as a flush replaces all buffers.
+def outputlines(options, pathname):
+   buffers = options['writer']['buffers']
+
+   lines = buffers.get(pathname)
+   if lines == None:
+      lines = []
+      buffers[pathname] = lines
+
+   return lines
+
+def countlines(options, lines, start):
+   writer = options['writer']
 
-   pathname = os.path.join(genpath, tfname)
-   filepath, filename = os.path.split(pathname)
+   count = len(lines) - start
+   size = count
+   for index in range(start, len(lines)):
+      size += len(lines[index])
+   writer['size'] += size
+
+   stats = options['stats']
+   if stats != None:
+      stats['lines'] += count
+      stats['bytes'] += size
+
+   if writer['size'] >= options['buffersize']:
+      flushlines(options)
+
+   return
+
+def flushlines(options):
+   writer = options['writer']
+
+   if writer['deferred'] != None:
+      if len(writer['buffers']) > 0:
+         writer['deferred'].append(('lines', writer['buffers']))
+   else:
+      writelines(options, writer['buffers'])
+
+   writer['buffers'] = {}
+   writer['size'] = 0
+
+   return
+
+def makefolder(options, filepath):
+   dirs = options['writer']['dirs']
 
    # Check for existing module directory.
-   if not os.path.exists(filepath):
-      # Create new module directory.
-      os.makedirs(filepath)
+   if not filepath in dirs:
+      if not os.path.exists(filepath):
+         # Create new module directory.
+         os.makedirs(filepath)
+      dirs.add(filepath)
 
-   if not os.path.exists(pathname):
-      tf = open(pathname, 'w')
-      tf.write(genheader)
+   return
+
+def writelines(options, buffers):
+   files = options['writer']['files']
+
+   start = time.perf_counter()
+
+   for pathname, lines in buffers.items():
+      header = False
+      if not pathname in files:
+         makefolder(options, os.path.dirname(pathname))
+         ownfile(options, pathname)
+         header = not os.path.exists(pathname)
+         files.add(pathname)
+
+      tf = open(pathname, 'a')
+      if header:
+         tf.write(genheader)
+         tf.write('\n')
+      text = '\n'.join(lines)
+      tf.write(text)
       tf.write('\n')
       tf.close()
 
-   tf = open(pathname, 'a')
-   tf.write(line)
-   tf.write('\n')
-   tf.close()
+      if options['stats'] != None:
+         recordfile(options, pathname, len(lines), len(text) + 1)
+
+   if options['stats'] != None:
+      options['stats']['write'] += time.perf_counter() - start
 
    return
 
-# Generate functions
+def copyfile(options, source, filepath):
+   writer = options['writer']
 
-def genproviders(options, name, sheet, df):
-   genpath = options['genpath']
+   if writer['deferred'] != None:
+      writer['deferred'].append(('copy', source, filepath))
+   else:
+      start = time.perf_counter()
+      pathname = os.path.normpath(os.path.join(filepath, os.path.basename(source)))
+      # Each destination is written once per run.
+      if writer['copies'].get(pathname) == source:
+         return
+      writer['copies'][pathname] = source
+      makefolder(options, filepath)
+      placed = placefile(options, source, pathname)
+      # Lines written after the copy are appended to it.
+      writer['files'].discard(pathname)
+
+      if options['stats'] != None:
+         if placed:
+            recordfile(options, pathname, 0, os.path.getsize(source))
+         options['stats']['write'] += time.perf_counter() - start
+
+   return
 
-   print(processingsheetmessage % name)
+# Hash of source file, computed once per writer.
+def sourcehash(options, source):
+   hashes = options['writer']['hashes']
 
-   name = name.replace(' ', '')
-   pos = name.find('-')
-   if pos >= 0:
-      sheettype = name[0:pos]
-      sheetgroup = name[pos+1:]
+   digest = hashes.get(source)
+   if digest == None:
+      digest = hashfile(source)
+      hashes[source] = digest
+
+   return digest
+
+def samesource(options, source, pathname):
+   if not os.path.isfile(pathname) or os.path.getsize(pathname) != os.path.getsize(source):
+      return False
+
+   return hashfile(pathname) == sourcehash(options, source)
+
+# Copy source file to pathname, or hardlink it with cloudinits link.
+# When rendering into an update folder, files of the output folder that
+# already have the content of source are kept for commitoutput instead of
+# being written. Returns True when the file was written.
+def placefile(options, source, pathname):
+   writer = options['writer']
+
+   if writer['updatepath'] != None:
+      relpath = os.path.relpath(pathname, writer['updatepath'])
+      if samesource(options, source, os.path.join(writer['outputpath'], relpath)):
+         writer['kept'].add(relpath)
+         if os.path.isfile(pathname):
+            os.remove(pathname)
+         return False
+      writer['kept'].discard(relpath)
+
+   if os.path.isfile(pathname):
+      # Replace rather than write through an existing hardlink.
+      os.remove(pathname)
+
+   if options['cloudinits'] == 'link':
+      linkfile(source, pathname)
    else:
-      sheettype = name
-      sheetgroup = ''
+      shutil.copy(source, pathname)
 
-   columns = df.columns
+   return True
 
-   # Loop thru rows.
-   for rowindex, row in df.iterrows():
-      tfname = row['file']
-      # Skip empty rows.
-      empty = novalue(tfname)
-      if empty:
+# Copied file that lines are appended to gets content of its own: a copy
+# kept from the output folder is written and a hardlink to the input file
+# is replaced by a copy.
+def ownfile(options, pathname):
+   writer = options['writer']
+
+   source = writer['copies'].get(pathname)
+   if source == None:
+      return
+
+   if not os.path.exists(pathname):
+      if writer['updatepath'] != None:
+         writer['kept'].discard(os.path.relpath(pathname, writer['updatepath']))
+      shutil.copy(source, pathname)
+   elif options['cloudinits'] == 'link' and os.stat(pathname).st_nlink > 1:
+      shutil.copy(source, pathname + '.tmp')
+      os.replace(pathname + '.tmp', pathname)
+
+   return
+
+# Apply flushed buffers and file copies recorded by a deferred writer.
+def replaywriter(options, deferred):
+   for entry in deferred:
+      if entry[0] == 'lines':
+         writelines(options, entry[1])
+      else:
+         copyfile(options, entry[1], entry[2])
+
+   return
+
+# Run statistics
+
+# With --stats, wall times of loading workbooks and sheets, generating each
+# sheet and writing output are recorded in options['stats'] together with
+# rows and cells read, and lines, bytes and opens of every output file.
+def newstats():
+   stats = {
+   'workbooks': [],
+   'sheets': [],
+   'files': {},
+   'lines': 0,
+   'bytes': 0,
+   'write': 0.0
+   }
+
+   return stats
+
+def recordworkbook(options, start):
+   stats = options['stats']
+   if stats != None:
+      stats['workbooks'].append({'workbook': options['propname'], 'file': options['propfile'], 'load': time.perf_counter() - start})
+
+   return
+
+def recordsheet(options, name, start):
+   stats = options['stats']
+   if stats != None:
+      stats['sheets'].append({
+      'workbook': options['propname'],
+      'sheet': name.replace(' ', ''),
+      'load': time.perf_counter() - start,
+      'generator': None,
+      'generate': 0.0,
+      'rows': 0,
+      'cells': 0,
+      'lines': 0,
+      'bytes': 0
+      })
+
+   return
+
+def recordfile(options, pathname, lines, size):
+   files = options['stats']['files']
+
+   entry = files.get(pathname)
+   if entry == None:
+      entry = {'lines': 0, 'bytes': 0, 'opens': 0}
+      files[pathname] = entry
+   entry['lines'] += lines
+   entry['bytes'] += size
+   entry['opens'] += 1
+
+   return
+
+def countrows(record, rows):
+   for rowindex, row, rowmask in rows:
+      record['rows'] += 1
+      record['cells'] += sum(rowmask)
+      yield rowindex, row, rowmask
+
+   return
+
+def gensheetstats(options, name, table, generator):
+   stats = options['stats']
+
+   # Sheets are recorded when loaded.
+   record = stats['sheets'][-1] if len(stats['sheets']) > 0 else None
+   if record == None or record['sheet'] != name or record['generator'] != None:
+      recordsheet(options, name, time.perf_counter())
+      record = stats['sheets'][-1]
+
+   lines = stats['lines']
+   size = stats['bytes']
+   start = time.perf_counter()
+   generator(options, name, {'columns': table['columns'], 'rows': countrows(record, table['rows'])})
+   record['generate'] = time.perf_counter() - start
+   record['generator'] = generator.__name__
+   record['lines'] = stats['lines'] - lines
+   record['bytes'] = stats['bytes'] - size
+
+   return
+
+# Add statistics returned by a process pool worker.
+def mergestats(options, stats):
+   if options['stats'] == None or stats == None:
+      return
+
+   options['stats']['workbooks'].extend(stats['workbooks'])
+   options['stats']['sheets'].extend(stats['sheets'])
+   options['stats']['lines'] += stats['lines']
+   options['stats']['bytes'] += stats['bytes']
+
+   return
+
+def printstats(options, total):
+   stats = options['stats']
+   sheets = stats['sheets']
+   files = stats['files']
+
+   load = sum(workbook['load'] for workbook in stats['workbooks']) + sum(sheet['load'] for sheet in sheets)
+   generate = sum(sheet['generate'] for sheet in sheets)
+
+   printmessage(options, '')
+   printmessage(options, '%-12s %-24s %-16s %9s %9s %8s %9s %8s %10s' % ('workbook', 'sheet', 'generator', 'load s', 'gen s', 'rows', 'cells', 'lines', 'bytes'))
+   for workbook in stats['workbooks']:
+      printmessage(options, '%-12s %-24s %-16s %9.3f' % (workbook['workbook'], '', 'loadfile', workbook['load']))
+   for sheet in sheets:
+      generator = sheet['generator'] if sheet['generator'] != None else '-'
+      printmessage(options, '%-12s %-24s %-16s %9.3f %9.3f %8d %9d %8d %10d' % (sheet['workbook'], sheet['sheet'], generator, sheet['load'], sheet['generate'], sheet['rows'], sheet['cells'], sheet['lines'], sheet['bytes']))
+
+   # Totals by generator.
+   generators = {}
+   for sheet in sheets:
+      if sheet['generator'] == None:
+         continue
+      entry = generators.setdefault(sheet['generator'], {'sheets': 0, 'generate': 0.0, 'rows': 0, 'cells': 0, 'lines': 0, 'bytes': 0})
+      entry['sheets'] += 1
+      for key in ['generate', 'rows', 'cells', 'lines', 'bytes']:
+         entry[key] += sheet[key]
+   printmessage(options, '')
+   printmessage(options, '%-16s %8s %9s %8s %9s %8s %10s' % ('generator', 'sheets', 'gen s', 'rows', 'cells', 'lines', 'bytes'))
+   for generator, entry in sorted(generators.items(), key=lambda item: -item[1]['generate']):
+      printmessage(options, '%-16s %8d %9.3f %8d %9d %8d %10d' % (generator, entry['sheets'], entry['generate'], entry['rows'], entry['cells'], entry['lines'], entry['bytes']))
+
+   # Largest output files.
+   printmessage(options, '')
+   printmessage(options, '%-48s %8s %10s %6s' % ('file', 'lines', 'bytes', 'opens'))
+   for pathname, entry in sorted(files.items(), key=lambda item: -item[1]['bytes'])[0:10]:
+      printmessage(options, '%-48s %8d %10d %6d' % (pathname, entry['lines'], entry['bytes'], entry['opens']))
+   printmessage(options, '%-48s %8d %10d %6d' % ('(%s files)' % len(files), sum(entry['lines'] for entry in files.values()), sum(entry['bytes'] for entry in files.values()), sum(entry['opens'] for entry in files.values())))
+
+   printmessage(options, '')
+   printmessage(options, 'Total %.3fs: load %.3fs, generate %.3fs, write %.3fs' % (total, load, generate, stats['write']))
+
+   if options['statspath'] != None:
+      report = {
+      'total': total,
+      'load': load,
+      'generate': generate,
+      'write': stats['write'],
+      'workbooks': stats['workbooks'],
+      'sheets': sheets,
+      'generators': generators,
+      'files': files
+      }
+      with open(options['statspath'], 'w') as f:
+         json.dump(report, f, indent=2)
+      printmessage(options, savedstatsmessage % options['statspath'])
+
+   return
+
+# File that can be created or replaced.
+def writablefile(pathname):
+   if os.path.isdir(pathname):
+      return False
+   if os.path.exists(pathname):
+      return os.access(pathname, os.W_OK)
+
+   folder = os.path.dirname(pathname)
+   if folder == '':
+      folder = '.'
+
+   return os.path.isdir(folder) and os.access(folder, os.W_OK)
+
+# Incremental regeneration
+
+# Hash of file content or of names and content of files in folder.
+def hashfile(pathname):
+   digest = hashlib.sha256()
+
+   if os.path.isdir(pathname):
+      pathnames = [os.path.join(pathname, afile) for afile in sorted(os.listdir(pathname))]
+   else:
+      pathnames = [pathname]
+
+   for afile in pathnames:
+      if not os.path.isfile(afile):
          continue
+      digest.update(os.path.basename(afile).encode('utf-8'))
+      with open(afile, 'rb') as f:
+         for chunk in iter(lambda: f.read(1048576), b''):
+            digest.update(chunk)
+
+   return digest.hexdigest()
+
+def hashframe(frame):
+   digest = hashlib.sha256()
+   digest.update(repr(frame['columns']).encode('utf-8'))
+   for values, codes in zip(frame['values'], frame['codes']):
+      digest.update(repr(values).encode('utf-8'))
+      digest.update(codes.astype('<u4').tobytes())
+
+   return digest.hexdigest()
+
+# Manifest is only used if created with the same tool version and input folder.
+def manifestkey(options):
+   return COPYRIGHT + ' ' + os.path.abspath(options['datapath'])
+
+def loadmanifest(options):
+   manifest = {'key': manifestkey(options), 'workbooks': {}, 'outputs': []}
+
+   pathname = os.path.join(options['genpath'], manifestname)
+   if os.path.isfile(pathname):
+      try:
+         with open(pathname, 'r') as f:
+            previous = json.load(f)
+         if previous.get('key') == manifest['key']:
+            manifest = previous
+      except ValueError:
+         pass
+
+   return manifest
+
+def savemanifest(options, manifest):
+   pathname = os.path.join(options['genpath'], manifestname)
+   with open(pathname, 'w') as f:
+      json.dump(manifest, f)
+
+   return
+
+# Deferred writer entries with output paths relative to the output folder.
+def relativeentries(options, deferred):
+   genpath = options['genpath']
+
+   entries = []
+   for entry in deferred:
+      if entry[0] == 'lines':
+         buffers = {}
+         for pathname, lines in entry[1].items():
+            buffers[os.path.relpath(pathname, genpath)] = lines
+         entries.append(['lines', buffers])
       else:
-         tfname = tfname.replace(' ', '')
+         entries.append(['copy', entry[1], os.path.relpath(entry[2], genpath)])
+
+   return entries
+
+# Build output files in memory from sheet fragments and write them to folder.
+def writeimage(options, entries, folder):
+   encoding = locale.getpreferredencoding(False)
+
+   # Content of each file is the source file copied to it, if any, and the
+   # chunks of lines appended after the copy, as written by copyfile and
+   # writelines.
+   image = {}
+   copied = {}
+   for entry in entries:
+      if entry[0] == 'lines':
+         for relpath, lines in entry[1].items():
+            content = image.get(relpath)
+            if content == None:
+               content = [None, [(genheader + '\n').replace('\n', os.linesep).encode(encoding)]]
+               image[relpath] = content
+            text = '\n'.join(lines) + '\n'
+            content[1].append(text.replace('\n', os.linesep).encode(encoding))
+      else:
+         source = entry[1]
+         if os.path.isfile(source):
+            relpath = os.path.normpath(os.path.join(entry[2], os.path.basename(source)))
+            if copied.get(relpath) == source:
+               continue
+            copied[relpath] = source
+            image[relpath] = [source, []]
+
+   start = time.perf_counter()
+   for relpath, (source, chunks) in image.items():
+      pathname = os.path.join(folder, relpath)
+      filepath = os.path.dirname(pathname)
+      if not os.path.exists(filepath):
+         os.makedirs(filepath)
+
+      if source != None and len(chunks) == 0:
+         if placefile(options, source, pathname) and options['stats'] != None:
+            recordfile(options, pathname, 0, os.path.getsize(source))
+         continue
 
-      #resource = row['resource']
-      #empty = novalue(resource)
-      #if empty:
-      #   print(missingvaluemessage % ('resource', rowindex))
-      #   continue
+      size = 0
+      with open(pathname, 'wb') as f:
+         if source != None:
+            with open(source, 'rb') as s:
+               shutil.copyfileobj(s, f)
+            size = os.path.getsize(source)
+         for chunk in chunks:
+            f.write(chunk)
 
-      module = row['module']
-      empty = novalue(module)
-      if empty:
-         module = '.'
+      if options['stats'] != None:
+         recordfile(options, pathname, sum(chunk.count(b'\n') for chunk in chunks), size + sum(len(chunk) for chunk in chunks))
+
+   if options['stats'] != None:
+      options['stats']['write'] += time.perf_counter() - start
+
+   return
+
+# Update output
+
+# Output is rendered into a temporary folder next to the output folder.
+def newupdatefolder(options):
+   updatepath = os.path.normpath(options['genpath']) + '.update'
+
+   if os.path.exists(updatepath):
+      shutil.rmtree(updatepath)
+   os.makedirs(updatepath)
+
+   return updatepath
+
+def samecontent(pathname, otherpathname):
+   if os.path.getsize(pathname) != os.path.getsize(otherpathname):
+      return False
+
+   return hashfile(pathname) == hashfile(otherpathname)
+
+# Move files rendered in update folder into the output folder where content
+# differs. Each file is replaced by an atomic rename so unchanged files keep
+# their modification time and readers never see partial files. Files kept
+# from the output folder are outputs without being rendered again. Files from
+# the previous run no longer generated are removed.
+def commitoutput(options, updatepath, previousoutputs, kept=()):
+   genpath = options['genpath']
+
+   outputs = []
+   changed = 0
+   for root, dirs, files in os.walk(updatepath):
+      for afile in files:
+         temppath = os.path.join(root, afile)
+         relpath = os.path.relpath(temppath, updatepath)
+         outputs.append(relpath)
+         pathname = os.path.join(genpath, relpath)
+         if os.path.isfile(pathname) and samecontent(temppath, pathname):
+            continue
+         filepath = os.path.dirname(pathname)
+         if not os.path.exists(filepath):
+            os.makedirs(filepath)
+         os.replace(temppath, pathname)
+         changed += 1
+
+   generated = set(outputs)
+   for relpath in sorted(kept):
+      if not relpath in generated and os.path.isfile(os.path.join(genpath, relpath)):
+         outputs.append(relpath)
+         generated.add(relpath)
+
+   removed = 0
+   for relpath in previousoutputs:
+      if not relpath in generated:
+         pathname = os.path.join(genpath, relpath)
+         if os.path.isfile(pathname):
+            os.remove(pathname)
+            removed += 1
+
+   shutil.rmtree(updatepath)
+
+   printmessage(options, updatedoutputmessage % (changed, len(outputs), genpath, removed))
+
+   return sorted(outputs)
+
+# Backups
+
+# Backups of the output folder are listed in an index file next to it
+# so a new backup number is found without probing for existing names.
+backupextensions = ['.zip', '.tar.gz', '.tar.zst']
+
+def backupindex(options):
+   return os.path.normpath(options['genpath']) + '.backupindex'
+
+def loadbackups(options):
+   pathname = backupindex(options)
+   if os.path.isfile(pathname):
+      try:
+         with open(pathname, 'r') as f:
+            return json.load(f)
+      except ValueError:
+         pass
+
+   # Build index from existing backups.
+   genpath = os.path.normpath(options['genpath'])
+   parent = os.path.dirname(genpath)
+   prefix = os.path.basename(genpath) + '.backup'
+   backups = []
+   for afile in os.listdir(parent if parent != '' else '.'):
+      if not afile.startswith(prefix):
+         continue
+      number = afile[len(prefix):]
+      for extension in backupextensions:
+         if number.endswith(extension):
+            number = number[0:-len(extension)]
+      if number.isdigit():
+         modified = os.path.getmtime(os.path.join(parent, afile))
+         backups.append({'number': int(number), 'name': afile, 'time': modified})
+   backups.sort(key=lambda backup: backup['number'])
+
+   return backups
+
+def savebackups(options, backups):
+   pathname = backupindex(options)
+   temppath = pathname + '.tmp'
+   with open(temppath, 'w') as f:
+      json.dump(backups, f)
+   os.replace(temppath, pathname)
+
+   return
+
+def newbackup(options, backups):
+   genpath = os.path.normpath(options['genpath'])
+
+   number = 1
+   if len(backups) > 0:
+      number = backups[-1]['number'] + 1
+
+   genbackup = genpath + '.backup' + str(number)
+   # Skip names taken outside of the index.
+   while os.path.exists(genbackup):
+      number += 1
+      genbackup = genpath + '.backup' + str(number)
+
+   return genbackup
+
+# Write backup folder to compressed archive and remove folder.
+# tar.zst needs the zstandard package and falls back to tar.gz.
+def archivebackup(options, genbackup):
+   import tarfile
+
+   archive = options['archive']
+
+   parent = os.path.dirname(genbackup)
+   name = os.path.basename(genbackup)
+
+   if archive == 'tar.zst':
+      try:
+         import zstandard
+      except ImportError:
+         printmessage(options, missingarchivermessage % archive)
+         archive = 'tar.gz'
+
+   if archive == 'zip':
+      archivepath = shutil.make_archive(genbackup, 'zip', root_dir=parent if parent != '' else '.', base_dir=name)
+   elif archive == 'tar.gz':
+      archivepath = shutil.make_archive(genbackup, 'gztar', root_dir=parent if parent != '' else '.', base_dir=name)
+   else:
+      archivepath = genbackup + '.tar.zst'
+      with open(archivepath, 'wb') as f:
+         with zstandard.ZstdCompressor().stream_writer(f) as stream:
+            with tarfile.open(fileobj=stream, mode='w|') as tar:
+               tar.add(genbackup, arcname=name)
+
+   shutil.rmtree(genbackup)
+   printmessage(options, archivedbackupmessage % (genbackup, archivepath))
+
+   return archivepath
+
+def removebackup(options, backup):
+   parent = os.path.dirname(os.path.normpath(options['genpath']))
+   pathname = os.path.join(parent, backup['name'])
+
+   if os.path.isdir(pathname):
+      shutil.rmtree(pathname)
+   elif os.path.isfile(pathname):
+      os.remove(pathname)
+   printmessage(options, removedbackupmessage % pathname)
+
+   return
+
+# Add new backup to index, archiving it if requested, then remove backups
+# beyond keepbackups newest or older than keepdays.
+def retainbackups(options, backups, genbackup):
+   number = int(genbackup[len(os.path.normpath(options['genpath']) + '.backup'):])
+
+   if options['archive'] != 'none':
+      genbackup = archivebackup(options, genbackup)
+
+   backups.append({'number': number, 'name': os.path.basename(genbackup), 'time': time.time()})
+
+   expired = None
+   if options['keepdays'] > 0:
+      expired = time.time() - options['keepdays'] * 86400
+
+   keep = []
+   for position, backup in enumerate(reversed(backups)):
+      if (options['keepbackups'] > 0 and position >= options['keepbackups']) or (expired != None and backup['time'] < expired and position > 0):
+         removebackup(options, backup)
+      else:
+         keep.insert(0, backup)
+
+   savebackups(options, keep)
+
+   return
+
+# Output staging
+
+# Linux ioctl to clone file extents on copy-on-write filesystems.
+FICLONE = 0x40049409
+
+def clonefile(source, target):
+   try:
+      import fcntl
+      with open(source, 'rb') as s, open(target, 'wb') as t:
+         fcntl.ioctl(t.fileno(), FICLONE, s.fileno())
+      shutil.copystat(source, target)
+   except (ImportError, OSError):
+      shutil.copy2(source, target)
+
+   return target
+
+def linkfile(source, target):
+   try:
+      os.link(source, target)
+   except OSError:
+      shutil.copy2(source, target)
+
+   return target
+
+# Copy folder from previous output using staging method.
+# Hardlinked files are shared with the backup so link is only used for
+# files that are replaced rather than changed in place by tools.
+def stagefolder(options, source, target, shared=True):
+   staging = options['staging']
+
+   if staging == 'reflink':
+      shutil.copytree(source, target, copy_function=clonefile)
+   elif staging == 'link' and shared:
+      shutil.copytree(source, target, copy_function=linkfile)
+   else:
+      shutil.copytree(source, target)
+
+   return
+
+def stagefile(options, source, target):
+   if options['staging'] == 'reflink':
+      clonefile(source, target)
+   else:
+      shutil.copy(source, target)
+
+   return
+
+# Emission plans
+
+# Compile sheet columns into an emission plan once per sheet.
+# Each entry holds the column position, the attribute prefix to emit (None
+# to skip), the nested block key and the lines that open and close the block.
+# Column names with a dot are block.attribute, trailing digits on the block
+# name allow repeated blocks (e.g. network_interfaces2.subnet).
+def compileplan(columns, first, last, grouped=True, lastdot=False, skipname=False, blocks=None):
+   plan = []
+
+   for columnindex in range(first, last):
+      column = columns[columnindex]
+
+      if not grouped:
+         plan.append((columnindex, column + ' = ', None, None, None))
+         continue
+
+      column = column.replace(' ', '')
+
+      if lastdot:
+         dotpos = column.rfind('.')
       else:
-         module = module.replace(' ', '')
- 
-      tfname = os.path.join(module, tfname)
+         dotpos = column.find('.')
 
-      comments = row['comments']
-      empty = novalue(comments)
-      if not empty:
-        printline(options, tfname, '# ' + comments)
+      group = None
+      openlines = None
+      closelines = None
+      if dotpos >= 0:
+         group = column[0:dotpos]
+         column = column[dotpos+1:]
+         # Remove trailing digits from duplicated columns of arrays.
+         block = group.rstrip('0123456789')
+         if blocks != None and block in blocks:
+            openlines = blocks[block]
+         else:
+            openlines = [block + ' {']
+         closelines = ['}'] * len(openlines)
 
-      #printline(options, tfname, providerheader % name)
-      printline(options, tfname, providerheader % 'ibm')
+      if skipname and column == 'name':
+         plan.append((columnindex, None, group, openlines, closelines))
+      else:
+         plan.append((columnindex, column + ' = ', group, openlines, closelines))
 
-      savegroup = None
+   return plan
 
-      # Loop through columns skipping first column (file) and last 2 columns (modules and comments).
-      for columnindex in range(columns.size-2):
-         if columnindex < 1:
-            continue
+# Append lines of one row following an emission plan.
+def emitplan(lines, plan, row, rowmask):
+   savegroup = None
+   savecloselines = None
 
-         column = columns[columnindex]
-         value = row[column]
-         empty = novalue(value)
-         if empty:
-            continue
+   for columnindex, prefix, group, openlines, closelines in plan:
+      if not rowmask[columnindex]:
+         continue
 
+      if group != savegroup:
+         if savegroup != None:
+            # End of group or adjacent groups so close previous group.
+            lines.extend(savecloselines)
+         if group != None:
+            # Start group.
+            lines.extend(openlines)
+         savegroup = group
+         savecloselines = closelines
+
+      if prefix != None:
+         value = row[columnindex]
          if isinstance(value, int):
             value = str(value)
+         lines.append(prefix + value)
 
-         column = column.replace(' ', '')
-
-         dotpos = column.find('.')
-         if dotpos >= 0:
-            subgroup = column[0:dotpos]
-            subcolumn = column[dotpos+1:]
-            column = subcolumn
-            if savegroup == None:
-               # No group yet so start group.
-               savegroup = subgroup
-               # Remove trailing digits from duplicated columns of arrays.
-               subgroup = subgroup.rstrip('0123456789')
-               printline(options, tfname, subgroup + ' {')
-            elif savegroup != subgroup:
-               # Adjacent groups so close previous group and start next group.
-               savegroup = subgroup
-               # Remove trailing digits from duplicated columns of arrays.
-               subgroup = subgroup.rstrip('0123456789')
-               printline(options, tfname, '}')
-               printline(options, tfname, subgroup + ' {')
-         elif savegroup != None:
-            # End of group so close group.
-            savegroup = None
-            printline(options, tfname, '}')
-
-         if column != 'name':
-            printline(options, tfname, column + ' = ' + value)
-
-      if savegroup != None:
-         # End of row so close group.
-         savegroup = None
-         printline(options, tfname, '}')
-
-      printline(options, tfname, endprovider)
+   if savegroup != None:
+      # End of row so close group.
+      lines.extend(savecloselines)
 
    return
 
-def genversions(options, name, sheet, df):
-
-   #printline(options, tfname, 'terraform {')
-   #printline(options, tfname, 'required_version = ">= ' + terraformversion + '"')
-   #printline(options, tfname, 'required_providers {')
-   #printline(options, tfname, 'ibm = {')
-   #printline(options, tfname, 'source = "ibm-cloud/ibm"')
-   #printline(options, tfname, 'version = "' + providerversion + '"')
-   #printline(options, tfname, '}')
-   #printline(options, tfname, '}')
-   #printline(options, tfname, '}')
-
-   genpath = options['genpath']
-
-   print(processingsheetmessage % name)
+# Sheet specs
+
+# Sheets of blocks are rendered by rendersheet() with one block per row.
+# Columns between the leading file (and resource) columns and the trailing
+# module and comments columns are attributes or nested blocks.
+#   header, end: lines opening and closing the block
+#   resource: blocks are named by the resource column and header is
+#             formatted with resource type of sheet and resource name
+#   data: resources named data.<name> are rendered as data sources
+#   rules: rows following a resource row are rules blocks up to a row
+#          without name, resource rows use column names as is
+#   lastdot, skipname, blocks: nested blocks as in compileplan()
+#   compact: rows can be compacted into for_each resources with --compact
+sheetspecs = {
+'providers': {
+'header': providerheader % 'ibm',
+'end': endprovider,
+'resource': False,
+'data': False,
+'rules': False,
+'lastdot': False,
+'skipname': True,
+'blocks': None,
+'compact': False
+},
+# Block names are split at the last dot to allow nested provider blocks.
+'versions': {
+'header': terraformheader,
+'end': endterraform,
+'resource': False,
+'data': False,
+'rules': False,
+'lastdot': True,
+'skipname': True,
+'blocks': versionblocks,
+'compact': False
+},
+'aclrules': {
+'header': resourceheader,
+'end': endresource,
+'resource': True,
+'data': False,
+'rules': True,
+'lastdot': False,
+'skipname': False,
+'blocks': None,
+'compact': False
+},
+'resources': {
+'header': resourceheader,
+'end': endresource,
+'resource': True,
+'data': True,
+'rules': False,
+'lastdot': False,
+'skipname': False,
+'blocks': None,
+'compact': True
+}
+}
 
+# Sheet type is the sheet name up to the first dash.
+def sheettypeof(name):
    name = name.replace(' ', '')
+
    pos = name.find('-')
    if pos >= 0:
-      sheettype = name[0:pos]
-      sheetgroup = name[pos+1:]
+      return name[0:pos]
+
+   return name
+
+# Emission plans of sheet for rows and resource rows.
+# Resource rows of rules sheets use column names as is.
+def sheetplans(columns, spec):
+   # Columns between first column (file) or first 2 columns (file and resource)
+   # and last 2 columns (module and comments).
+   first = 2 if spec['resource'] else 1
+   plan = compileplan(columns, first, len(columns)-2, lastdot=spec['lastdot'], skipname=spec['skipname'], blocks=spec['blocks'])
+   if spec['rules']:
+      headerplan = compileplan(columns, first, len(columns)-2, grouped=False)
    else:
-      sheettype = name
-      sheetgroup = ''
-
-   columns = df.columns
+      headerplan = plan
+
+   return plan, headerplan
+
+def rendersheet(options, name, table, spec):
+   printmessage(options, processingsheetmessage % name)
+
+   sheettype = sheettypeof(name)
+
+   columns = table['columns']
+
+   positions = dict(zip(columns, range(len(columns))))
+
+   # Required columns are checked when the first row is rendered
+   # as sheets without rows may have no columns.
+   required = ['file', 'module', 'comments']
+   if spec['resource']:
+      required.append('resource')
+   if spec['rules']:
+      required.append('name')
+   checked = False
+
+   filecolumn = positions.get('file')
+   modulecolumn = positions.get('module')
+   commentscolumn = positions.get('comments')
+   resourcecolumn = positions.get('resource') if spec['resource'] else None
+   namecolumn = positions.get('name')
+
+   plan, headerplan = sheetplans(columns, spec)
+
+   header = spec['header']
+   end = spec['end']
+
+   # Output paths by file and module.
+   pathnames = {}
+   pathname = None
+   rules = False
+
+   # Rows compacted into for_each resources by compactresources(),
+   # by position as expanded range rows share the row index.
+   rows = table['rows']
+   groups = {}
+   compacted = options.get('compacted')
+   if compacted != None and spec['compact']:
+      for group in compacted['groups'].get((options['propname'], name), []):
+         for position in group['rows']:
+            groups[position] = group
+   if len(groups) > 0:
+      rows = list(rows)
+      printmessage(options, compactedsheetmessage % (len(groups), name, len(set(group['label'] for group in groups.values()))))
+   position = -1
 
    # Loop thru rows.
-   for rowindex, row in df.iterrows():
-      tfname = row['file']
+   for rowindex, row, rowmask in rows:
+      position += 1
+
+      if not checked:
+         for column in required:
+            if not column in positions:
+               printmessage(options, missingcolumnmessage % (column, name))
+               return
+         checked = True
+
+      if rules:
+         lines = outputlines(options, pathname)
+         start = len(lines)
+         # End of rule group when name is empty.
+         if not rowmask[namecolumn]:
+            lines.append(end)
+            rules = False
+         else:
+            lines.append('rules {')
+            emitplan(lines, plan, row, rowmask)
+            lines.append('}')
+         countlines(options, lines, start)
+         continue
+
       # Skip empty rows.
-      empty = novalue(tfname)
-      if empty:
+      if not rowmask[filecolumn]:
          continue
-      else:
-         tfname = tfname.replace(' ', '')
+      tfname = row[filecolumn]
 
-      #resource = row['resource']
-      #empty = novalue(resource)
-      #if empty:
-      #   print(missingvaluemessage % ('resource', rowindex))
-      #   continue
+      if resourcecolumn != None:
+         if not rowmask[resourcecolumn]:
+            printmessage(options, missingvaluemessage % ('resource', rowindex))
+            continue
+         resource = row[resourcecolumn].replace(' ', '')
 
-      module = row['module']
-      empty = novalue(module)
-      if empty:
+      if rowmask[modulecolumn]:
+         module = row[modulecolumn]
+      else:
          module = '.'
+
+      key = (tfname, module)
+      pathname = pathnames.get(key)
+      if pathname == None:
+         pathname = outputpath(options, os.path.join(module.replace(' ', ''), tfname.replace(' ', '')))
+         pathnames[key] = pathname
+
+      lines = outputlines(options, pathname)
+      start = len(lines)
+
+      group = groups.get(position)
+      if group != None:
+         # Group is rendered at its first row.
+         if position == group['rows'][0]:
+            emitgroup(lines, plan, group, resources[sheettype], rows, commentscolumn)
+            countlines(options, lines, start)
+         continue
+
+      if rowmask[commentscolumn]:
+         lines.append('# ' + row[commentscolumn])
+
+      if resourcecolumn == None:
+         lines.append(header)
+         emitplan(lines, plan, row, rowmask)
+         lines.append(end)
+      elif spec['data'] and resource.startswith('data.'):
+         if not rowmask[namecolumn]:
+            printmessage(options, missingvaluemessage % ('resource', rowindex))
+            del lines[start:]
+            continue
+         lines.append(dataheader % (resources[sheettype], resource[5:]))
+         lines.append('name = ' + row[namecolumn])
+         lines.append(enddata)
       else:
-         module = module.replace(' ', '')
- 
-      tfname = os.path.join(module, tfname)
+         lines.append(header % (resources[sheettype], resource))
+         emitplan(lines, headerplan, row, rowmask)
+         if spec['rules']:
+            rules = True
+         else:
+            lines.append(end)
 
-      comments = row['comments']
-      empty = novalue(comments)
-      if not empty:
-        printline(options, tfname, '# ' + comments)
+      countlines(options, lines, start)
 
-      printline(options, tfname, terraformheader)
+   if rules:
+      lines = outputlines(options, pathname)
+      lines.append(end)
+      countlines(options, lines, len(lines) - 1)
 
-      savegroup = None
+   return
 
-      # Loop through columns skipping first column (file) and last 2 columns (modules and comments).
-      for columnindex in range(columns.size-2):
-         if columnindex < 1:
-            continue
+# Range rows
+
+# Resource names with a range such as web-[1..200] stand for one row per
+# number, with leading zeros of the first number kept (web-[01..20]).
+# Other cells of a range row can hold {i} for the number and {a|b|c} to
+# rotate through values by position in the range, e.g. var.zone{1|2|3}.
+# Values are not empty and have no spaces so braces of HCL expressions such
+# as { for k, v in var.m : k => v if v != "" || k == "" } are kept as is.
+rangepattern = re.compile(r'\[(\d+)\.\.(\d+)\]')
+placeholderpattern = re.compile(r'\{(i|[^{}|\s]+(?:\|[^{}|\s]+)+)\}')
+
+# Table with range rows of resource sheet expanded as rows are read.
+def expandtable(table):
+   columns = table['columns']
+
+   if not 'resource' in columns:
+      return table
+
+   return {'columns': columns, 'rows': expandrows(table['rows'], columns.index('resource'))}
+
+def expandrows(rows, resourcecolumn):
+   for rowindex, row, rowmask in rows:
+      if rowmask[resourcecolumn]:
+         resource = row[resourcecolumn]
+         if isinstance(resource, str) and resource.find('[') >= 0:
+            match = rangepattern.search(resource)
+            if match != None:
+               yield from expandrow(rowindex, row, rowmask, resourcecolumn, match)
+               continue
+      yield rowindex, row, rowmask
 
-         column = columns[columnindex]
-         value = row[column]
-         empty = novalue(value)
-         if empty:
-            continue
+   return
 
-         if isinstance(value, int):
-            value = str(value)
+# Expanded rows share the row index and mask of the range row.
+def expandrow(rowindex, row, rowmask, resourcecolumn, match):
+   resource = row[resourcecolumn]
+
+   first = match.group(1)
+   start = int(first)
+   stop = int(match.group(2))
+   step = 1 if stop >= start else -1
+   width = len(first) if first.startswith('0') else 0
+
+   # Cells with placeholders split into text and placeholders once.
+   templates = []
+   for columnindex in range(len(row)):
+      value = row[columnindex]
+      if columnindex != resourcecolumn and rowmask[columnindex] and isinstance(value, str) and value.find('{') >= 0:
+         parts = placeholderpattern.split(value)
+         if len(parts) > 1:
+            for partindex in range(1, len(parts), 2):
+               if parts[partindex] != 'i':
+                  parts[partindex] = parts[partindex].split('|')
+            templates.append((columnindex, parts))
+
+   for position, number in enumerate(range(start, stop + step, step)):
+      index = str(number).zfill(width)
+      expanded = list(row)
+      expanded[resourcecolumn] = resource[0:match.start()] + index + resource[match.end():]
+      for columnindex, parts in templates:
+         pieces = []
+         for partindex in range(len(parts)):
+            part = parts[partindex]
+            if partindex % 2 == 0:
+               pieces.append(part)
+            elif part == 'i':
+               pieces.append(index)
+            else:
+               pieces.append(part[position % len(part)])
+         expanded[columnindex] = ''.join(pieces)
+      yield rowindex, expanded, rowmask
 
-         column = column.replace(' ', '')
+   return
 
-         dotpos = column.rfind('.')
-         if dotpos >= 0:
-            subgroup = column[0:dotpos]
-            subcolumn = column[dotpos+1:]
-            column = subcolumn
-            if savegroup == None:
-               # No group yet so start group.
-               savegroup = subgroup
-               # Remove trailing digits from duplicated columns of arrays.
-               subgroup = subgroup.rstrip('0123456789')
-               if subgroup == 'required_providers.ibm':
-                  printline(options, tfname, 'required_providers {')
-                  printline(options, tfname, 'ibm = {')
-               else:
-                  printline(options, tfname, subgroup + ' {')
-            elif savegroup != subgroup:
-               # Adjacent groups so close previous group and start next group.
-               savegroup = subgroup
-               # Remove trailing digits from duplicated columns of arrays.
-               subgroup = subgroup.rstrip('0123456789')
-               printline(options, tfname, '}')
-               if subgroup == 'required_providers.ibm':
-                  printline(options, tfname, 'required_providers {')
-                  printline(options, tfname, 'ibm = {')
-
-               else:
-                  printline(options, tfname, subgroup + ' {')
-         elif savegroup != None:
-            # End of group so close group.
-            savegroup = None
-            printline(options, tfname, '}')
-            if subgroup == 'required_providers.ibm':
-               printline(options, tfname, '}')
-
-         if column != 'name':
-            printline(options, tfname, column + ' = ' + value)
-
-      if savegroup != None:
-         # End of row so close group.
-         savegroup = None
-         printline(options, tfname, '}')
-         if subgroup == 'required_providers.ibm':
-            printline(options, tfname, '}')
-
-      printline(options, tfname, endterraform)
+# Generate functions
+
+def genproviders(options, name, table):
+   rendersheet(options, name, table, sheetspecs['providers'])
 
    return
 
-def genoutputs(options, name, sheet, df):
+def genversions(options, name, table):
+   rendersheet(options, name, table, sheetspecs['versions'])
+
+   return
+
+def genoutputs(options, name, table):
    genpath = options['genpath']
    
-   print(processingsheetmessage % name)
+   printmessage(options, processingsheetmessage % name)
+
+   columns = table['columns']
 
-   columns = df.columns
+   positions = dict(zip(columns, range(len(columns))))
 
    # Loop thru rows.
-   for rowindex, row in df.iterrows():
-      tfname = row['file']
+   for rowindex, row, rowmask in table['rows']:
+      tfname = row[positions['file']]
       # Skip empty rows.
-      empty = novalue(tfname)
+      empty = not rowmask[positions['file']]
       if empty:
          continue
       else:
          tfname = tfname.replace(' ', '')
 
-      name = row['name']
-      empty = novalue(name)
+      name = row[positions['name']]
+      empty = not rowmask[positions['name']]
       if empty:
-         print(missingvaluemessage % ('name', rowindex))
+         printmessage(options, missingvaluemessage % ('name', rowindex))
          continue
       
-      value = row['value']
-      empty = novalue(value)
+      value = row[positions['value']]
+      empty = not rowmask[positions['value']]
       if empty:
-         print(missingvaluemessage % ('value', rowindex))
+         printmessage(options, missingvaluemessage % ('value', rowindex))
          continue
 
-      module = row['module']
-      empty = novalue(module)
+      module = row[positions['module']]
+      empty = not rowmask[positions['module']]
       if empty:
          module = '.'
       else:
@@ -470,8 +2061,8 @@ def genoutputs(options, name, sheet, df):
 
       tfname = os.path.join(module, tfname)
 
-      comments = row['comments']
-      empty = novalue(comments)
+      comments = row[positions['comments']]
+      empty = not rowmask[positions['comments']]
       if not empty:
         printline(options, tfname, '# ' + comments)
 
@@ -481,83 +2072,98 @@ def genoutputs(options, name, sheet, df):
 
    return
 
-def gencloudinits(options, name, sheet, df):
+def gencloudinits(options, name, table):
    genpath = options['genpath']
    
-   print(processingsheetmessage % name)
+   printmessage(options, processingsheetmessage % name)
 
-   columns = df.columns
+   # Write pending lines before copying files into the output folder.
+   flushlines(options)
+
+   columns = table['columns']
+
+   positions = dict(zip(columns, range(len(columns))))
+
+   initspath = os.path.join(options['datapath'], 'cloudinits')
+
+   # Collect unique file and module pairs so each file is copied once
+   # however many rows refer to it.
+   copies = {}
 
    # Loop thru rows.
-   for rowindex, row in df.iterrows():
-      tfname = row['file']
+   for rowindex, row, rowmask in table['rows']:
+      tfname = row[positions['file']]
       # Skip empty rows.
-      empty = novalue(tfname)
+      empty = not rowmask[positions['file']]
       if empty:
          continue
       else:
          tfname = tfname.replace(' ', '')
 
-      resource = row['resource']
-      empty = novalue(resource)
+      resource = row[positions['resource']]
+      empty = not rowmask[positions['resource']]
       if empty:
-         print(missingvaluemessage % ('resource', rowindex))
+         printmessage(options, missingvaluemessage % ('resource', rowindex))
          continue
       
-      module = row['module']
-      empty = novalue(module)
+      module = row[positions['module']]
+      empty = not rowmask[positions['module']]
       if empty:
          module = '.'
       else:
          module = module.replace(' ', '')
 
-      datapath = options['datapath']
-      initspath = os.path.join(datapath, 'cloudinits')
-      tfname = os.path.join(initspath, tfname)
-
-      if os.path.isdir(initspath) and os.path.isfile(tfname):
-         filepath = os.path.join(genpath, module)
-         # Check for existing module directory.
-         if not os.path.exists(filepath):
-            # Create new module directory.
-            os.makedirs(filepath)
-         shutil.copy(tfname, filepath)
+      source = os.path.join(initspath, tfname)
+      filepath = os.path.join(genpath, module)
+      if not (source, filepath) in copies:
+         copies[(source, filepath)] = (tfname, rowindex)
+
+   found = {}
+   for (source, filepath), (tfname, rowindex) in copies.items():
+      if not source in found:
+         found[source] = os.path.isfile(source)
+      if found[source]:
+         copyfile(options, source, filepath)
+      else:
+         printmessage(options, missingcloudinitmessage % (tfname, rowindex))
 
    return
 
-def genvariables(options, name, sheet, df):
+def genvariables(options, name, table):
    genpath = options['genpath']
    
-   print(processingsheetmessage % name)
+   printmessage(options, processingsheetmessage % name)
 
-   columns = df.columns
+   columns = table['columns']
+
+   positions = dict(zip(columns, range(len(columns))))
 
    # Loop thru rows.
-   for rowindex, row in df.iterrows():
-      tfname = row['file']
+   for rowindex, row, rowmask in table['rows']:
+      tfname = row[positions['file']]
       # Skip empty rows.
-      empty = novalue(tfname)
+      empty = not rowmask[positions['file']]
       if empty:
          continue
       else:
          tfname = tfname.replace(' ', '')
 
-      name = row['name']
-      empty = novalue(name)
+      name = row[positions['name']]
+      empty = not rowmask[positions['name']]
       if empty:
-         print(missingvaluemessage % ('name', rowindex))
+         printmessage(options, missingvaluemessage % ('name', rowindex))
          continue
       
       emptyvalue = False
-      value = row['value']
-      empty = novalue(value)
+      value = row[positions['value']]
+      empty = not rowmask[positions['value']]
       if empty:
          emptyvalue = True
          #print(missingvaluemessage % ('value', rowindex))
          #continue
 
-      module = row['module']
-      empty = novalue(module)
+      module = row[positions['module']]
+      empty = not rowmask[positions['module']]
       if empty:
          module = '.'
       else:
@@ -567,8 +2173,8 @@ def genvariables(options, name, sheet, df):
 
       printline(options, tfname, variableheader % name)
 
-      comments = row['comments']
-      empty = novalue(comments)
+      comments = row[positions['comments']]
+      empty = not rowmask[positions['comments']]
       if not empty:
          #printline(options, tfname, '# ' + comments)
          printline(options, tfname, 'description = "' + comments + '"')
@@ -580,42 +2186,44 @@ def genvariables(options, name, sheet, df):
 
    return
 
-def genmodules(options, name, sheet, df):
+def genmodules(options, name, table):
    genpath = options['genpath']
    
-   print(processingsheetmessage % name)
+   printmessage(options, processingsheetmessage % name)
 
    tfname = 'modules.tf'
    module = name.split('-')[1]
 
    printline(options, tfname, moduleheader % module)
 
-   columns = df.columns
+   columns = table['columns']
+
+   positions = dict(zip(columns, range(len(columns))))
 
    # Loop thru rows.
-   for rowindex, row in df.iterrows():
-      tfnameignore = row['file']
+   for rowindex, row, rowmask in table['rows']:
+      tfnameignore = row[positions['file']]
       # Skip empty rows.
-      empty = novalue(tfnameignore)
+      empty = not rowmask[positions['file']]
       if empty:
          continue
 
-      name = row['name']
-      empty = novalue(name)
+      name = row[positions['name']]
+      empty = not rowmask[positions['name']]
       if empty:
-         print(missingvaluemessage % ('name', rowindex))
+         printmessage(options, missingvaluemessage % ('name', rowindex))
          continue
       
       emptyvalue = False
-      value = row['value']
-      empty = novalue(value)
+      value = row[positions['value']]
+      empty = not rowmask[positions['value']]
       if empty:
          emptyvalue = True
          #print(missingvaluemessage % ('value', rowindex))
          #continue
 
-      module = row['module']
-      empty = novalue(module)
+      module = row[positions['module']]
+      empty = not rowmask[positions['module']]
       if empty:
          module = '.'
       else:
@@ -625,8 +2233,8 @@ def genmodules(options, name, sheet, df):
 
       #printline(options, tfname, moduleheader % name)
 
-      comments = row['comments']
-      empty = novalue(comments)
+      comments = row[positions['comments']]
+      empty = not rowmask[positions['comments']]
       if not empty:
          printline(options, tfname, '# ' + comments)
          #printline(options, tfname, 'description = "' + comments + '"')
@@ -641,271 +2249,687 @@ def genmodules(options, name, sheet, df):
 
    return
 
-def genaclresources(options, name, sheet, df):
-   genpath = options['genpath']
-   
-   print(processingsheetmessage % name)
+def genaclresources(options, name, table):
+   rendersheet(options, name, table, sheetspecs['aclrules'])
 
-   name = name.replace(' ', '')
-   pos = name.find('-')
-   if pos >= 0:
-      sheettype = name[0:pos]
-      sheetgroup = name[pos+1:]
-   else:
-      sheettype = name
-      sheetgroup = ''
+   return
 
-   columns = df.columns
+def genresources(options, name, table):
+   rendersheet(options, name, table, sheetspecs['resources'])
 
-   header = True
-   tfname = None
+   return
 
-   # Loop thru rows.
-   for rowindex, row in df.iterrows():
-      if header:
-         tfname = row['file']
-         # Skip empty rows.
-         empty = novalue(tfname)
-         if empty:
-            continue
-         else:
-            tfname = tfname.replace(' ', '')
+# Sheet generators by sheet type.
+# Sheets of other types are resources.
+sheetgenerators = {
+'variables': genvariables,
+'outputs': genoutputs,
+'cloudinits': gencloudinits,
+'modules': genmodules,
+'providers': genproviders,
+'versions': genversions,
+'aclrules': genaclresources
+}
 
-         resource = row['resource']
-         empty = novalue(resource)
-         if empty:
-            print(missingvaluemessage % ('resource', rowindex))
-            continue
-         else:
-            resource = resource.replace(' ', '')
-
-         #resource_data = False
-         #resource = resource.replace(' ', '')
-         #pos = resource.find('.')
-         #if pos >= 0:
-         #   if resource[0:pos] == 'data':
-         #      resource_data = True
-         #      resource = resource[pos+1:]
-
-         header = False
-
-         module = row['module']
-         empty = novalue(module)
-         if empty:
-            module = '.'
-         else:
-            module = module.replace(' ', '')
+def sheetgenerator(name):
+   generator = sheetgenerators.get(sheettypeof(name))
+   if generator != None:
+      return generator
 
-         tfname = os.path.join(module, tfname)
+   # Sheet names starting with a sheet type.
+   for sheettype, generator in sheetgenerators.items():
+      if name.startswith(sheettype):
+         return generator
 
-         comments = row['comments']
-         empty = novalue(comments)
-         if not empty:
-            printline(options, tfname, '# ' + comments)
+   return genresources
 
-         #if resource_data == True:
-         #   printline(options, tfname, dataheader % (resources[sheettype], resource))
-         #else:
-         printline(options, tfname, resourceheader % (resources[sheettype], resource))
+def gensheet(options, name, table):
+   generator = sheetgenerator(name)
 
-         # Loop through columns skipping first 2 columns (file and resource) and last 2 columns (module and comments).
-         for columnindex in range(columns.size-2):
-            if columnindex < 2:
-               continue
+   if generator == genresources:
+      table = expandtable(table)
 
-            column = columns[columnindex]
-            value = row[column]
-            empty = novalue(value)
-            if empty:
-               continue
+   compacted = options.get('compacted')
+   if compacted != None and len(compacted['addresses']) > 0:
+      table = {'columns': table['columns'], 'rows': compactedrows(compacted['addresses'], generator, table)}
 
-            if isinstance(value, int):
-               value = str(value)
+   if options['stats'] == None:
+      generator(options, name, table)
+   else:
+      gensheetstats(options, name, table, generator)
 
-            printline(options, tfname, column + ' = ' + value)
-      else:
-         name = row['name']
-         # End of rule group when name is empty.
-         empty = novalue(name)
-         if empty:
-            printline(options, tfname, '}')
-            header = True
-            continue
+   return
 
-         printline(options, tfname, 'rules {')
+# Generate sheet unless unchanged since the previous run.
+# Rendered fragments of each sheet are collected in options['sheets']
+# for the manifest and the output update.
+def gensheetincremental(options, name, frame):
+   writer = options['writer']
 
-         savegroup = None
+   sheethash = hashframe(frame)
 
-         # Loop through columns skipping first 2 columns (file and resource) and last 2 columns (module and comments).
-         for columnindex in range(columns.size-2):
-            if columnindex < 2:
-               continue
+   previous = options['previous'].get(name)
+   if previous != None and previous['hash'] == sheethash:
+      printmessage(options, reusingsheetmessage % name)
+      entries = previous['entries']
+   else:
+      flushlines(options)
+      start = len(writer['deferred'])
+      gensheet(options, name, sheettable(frame))
+      flushlines(options)
+      entries = relativeentries(options, writer['deferred'][start:])
 
-            column = columns[columnindex]
-            value = row[column]
-            empty = novalue(value)
-            if empty:
-               continue
+   options['sheets'].append({'name': name, 'hash': sheethash, 'entries': entries})
 
-            if isinstance(value, int):
-               value = str(value)
-
-            column = column.replace(' ', '')
-            dotpos = column.find('.')
-            if dotpos >= 0:
-               subgroup = column[0:dotpos]
-               subcolumn = column[dotpos+1:]
-               column = subcolumn
-               if savegroup == None:
-                  # No group yet so start group.
-                  savegroup = subgroup
-                  # Remove trailing digits from duplicated columns of arrays.
-                  subgroup = subgroup.rstrip('0123456789')
-                  printline(options, tfname, subgroup + ' {')
-               elif savegroup != subgroup:
-                  # Adjacent groups so close previous group and start next group.
-                  savegroup = subgroup
-                  # Remove trailing digits from duplicated columns of arrays.
-                  subgroup = subgroup.rstrip('0123456789')
-                  printline(options, tfname, '}')
-                  printline(options, tfname, subgroup + ' {')
-            elif savegroup != None:
-               # End of group so close group.
-               savegroup = None
-               printline(options, tfname, '}')
-
-            printline(options, tfname, column + ' = ' + value)
+   return
 
-         if savegroup != None:
-            # End of row so close group.
-            savegroup = None
-            printline(options, tfname, '}')
+# Reference check
+
+# References in cell values: var.name, module.name with optional output,
+# data.type.name and type.name for resource types.
+referencepattern = re.compile(r'\b(?:(var)\.([A-Za-z0-9_-]+)|(module)\.([A-Za-z0-9_-]+)(?:\.([A-Za-z0-9_-]+))?|(data)\.([A-Za-z0-9_]+)\.([A-Za-z0-9_-]+)|([a-z][a-z0-9]*_[a-z0-9_]+)\.([A-Za-z0-9_-]+))')
+
+# Blocks declared in Terraform files copied from cloudinits.
+declarationpattern = re.compile(r'^\s*(resource|data|variable|module|output)\s+"([^"]+)"(?:\s+"([^"]+)")?', re.MULTILINE)
 
-         printline(options, tfname, '}')
+def newsymbols():
+   symbols = {
+   'declared': {},
+   'outputs': {},
+   'sources': {},
+   'types': set(resources.values()),
+   'references': []
+   }
 
-   if tfname != None:
-      printline(options, tfname, endresource)
+   return symbols
+
+def declare(symbols, module, symbol):
+   declared = symbols['declared'].get(module)
+   if declared == None:
+      declared = set()
+      symbols['declared'][module] = declared
+   declared.add(symbol)
 
    return
 
-def genresources(options, name, sheet, df):
-   genpath = options['genpath']
-   
-   print(processingsheetmessage % name)
+# Record references in value for checking once all names are declared.
+def scanvalue(symbols, module, value, location):
+   if not isinstance(value, str) or value.find('.') < 0:
+      return
 
-   name = name.replace(' ', '')
-   pos = name.find('-')
-   if pos >= 0:
-      sheettype = name[0:pos]
-      sheetgroup = name[pos+1:]
-   else:
-      sheettype = name
-      sheetgroup = ''
+   for match in referencepattern.finditer(value):
+      if match.group(1) != None:
+         symbols['references'].append((module, 'var.' + match.group(2), None, location))
+      elif match.group(3) != None:
+         symbols['references'].append((module, 'module.' + match.group(4), match.group(5), location))
+      elif match.group(6) != None:
+         symbols['references'].append((module, 'data.' + match.group(7) + '.' + match.group(8), None, location))
+      else:
+         symbols['references'].append((module, match.group(9) + '.' + match.group(10), None, location))
 
-   columns = df.columns
+   return
 
-   # Loop thru rows.
-   for rowindex, row in df.iterrows():
-      tfname = row['file']
-      # Skip empty rows.
-      empty = novalue(tfname)
-      if empty:
-         continue
+def scancloudinit(options, symbols, module, tfname):
+   pathname = os.path.join(options['datapath'], 'cloudinits', tfname)
+   if not os.path.isfile(pathname):
+      return
+
+   with open(pathname, 'r') as f:
+      text = f.read()
+
+   for block, first, second in declarationpattern.findall(text):
+      if block == 'resource':
+         symbols['types'].add(first)
+         declare(symbols, module, first + '.' + second)
+      elif block == 'data':
+         declare(symbols, module, 'data.' + first + '.' + second)
+      elif block == 'variable':
+         declare(symbols, module, 'var.' + first)
+      elif block == 'module':
+         declare(symbols, module, 'module.' + first)
       else:
-         tfname = tfname.replace(' ', '')
+         symbols['outputs'].setdefault(module, set()).add(first)
 
-      resource = row['resource']
-      empty = novalue(resource)
-      if empty:
-         print(missingvaluemessage % ('resource', rowindex))
+   return
+
+# Collect declarations and references of one sheet following the generator
+# used for the sheet.
+def scansheet(options, symbols, name, table):
+   generator = sheetgenerator(name)
+   sheettype = sheettypeof(name)
+
+   if generator == genresources:
+      table = expandtable(table)
+
+   columns = table['columns']
+
+   positions = dict(zip(columns, range(len(columns))))
+
+   if generator == genproviders or generator == genversions:
+      return
+   if not 'file' in positions:
+      return
+
+   modulecolumn = positions.get('module')
+   namecolumn = positions.get('name')
+   valuecolumn = positions.get('value')
+   resourcecolumn = positions.get('resource')
+
+   # Module sheets are written to the root module.
+   if generator == genmodules:
+      modulename = name.split('-')[1]
+      declare(symbols, '.', 'module.' + modulename)
+
+   module = '.'
+   for rowindex, row, rowmask in table['rows']:
+      location = (options['propname'], name, rowindex)
+
+      if not rowmask[positions['file']]:
+         # Rules of ACL follow the header row without file.
+         if generator == genaclresources:
+            for columnindex in range(2, len(columns)-2):
+               if rowmask[columnindex]:
+                  scanvalue(symbols, module, row[columnindex], location)
          continue
+
+      module = '.'
+      if modulecolumn != None and rowmask[modulecolumn]:
+         module = os.path.normpath(row[modulecolumn].replace(' ', '')) or '.'
+
+      if generator == genvariables:
+         if namecolumn != None and rowmask[namecolumn]:
+            declare(symbols, module, 'var.' + row[namecolumn])
+      elif generator == genoutputs:
+         if namecolumn != None and rowmask[namecolumn]:
+            symbols['outputs'].setdefault(module, set()).add(row[namecolumn])
+         if valuecolumn != None and rowmask[valuecolumn]:
+            scanvalue(symbols, module, row[valuecolumn], location)
+      elif generator == genmodules:
+         if valuecolumn != None and rowmask[valuecolumn]:
+            value = row[valuecolumn]
+            if namecolumn != None and rowmask[namecolumn] and row[namecolumn] == 'source':
+               source = value.strip('"')
+               if source.startswith('./'):
+                  symbols['sources'][modulename] = os.path.normpath(source)
+            else:
+               scanvalue(symbols, '.', value, location)
+      elif generator == gencloudinits:
+         scancloudinit(options, symbols, module, row[positions['file']].replace(' ', ''))
       else:
-         resource = resource.replace(' ', '')
-
-      resource_data = False
-      resource = resource.replace(' ', '')
-      pos = resource.find('.')
-      if pos >= 0:
-         if resource[0:pos] == 'data':
-            resource_data = True
-            resource = resource[pos+1:]
-
-      module = row['module']
-      empty = novalue(module)
-      if empty:
-         module = '.'
+         if resourcecolumn != None and rowmask[resourcecolumn] and sheettype in resources:
+            resource = row[resourcecolumn].replace(' ', '')
+            if resource.startswith('data.') and generator == genresources:
+               declare(symbols, module, 'data.' + resources[sheettype] + '.' + resource[5:])
+            else:
+               declare(symbols, module, resources[sheettype] + '.' + resource)
+         for columnindex in range(2, len(columns)-2):
+            if rowmask[columnindex]:
+               scanvalue(symbols, module, row[columnindex], location)
+
+   return
+
+# Check references of all workbooks against names declared in the same
+# module before any output is written. Sheets are kept in jobs to be
+# generated without reading the workbooks again, except when streaming.
+# Returns unresolved references with workbook, sheet and row.
+def checkreferences(options, jobs):
+   symbols = newsymbols()
+
+   for job in jobs:
+      frames = []
+      for name, sheet, frame in loadframes(job):
+         name = name.replace(' ', '')
+         scansheet(job, symbols, name, sheettable(frame))
+         if not job['stream']:
+            frames.append((name, frame))
+      if not job['stream']:
+         job['frames'] = frames
+
+   unresolved = []
+   for module, symbol, output, location in symbols['references']:
+      declared = symbols['declared'].get(module, ())
+      if symbol.startswith('module.'):
+         if not symbol in declared:
+            unresolved.append((symbol, location))
+            continue
+         source = symbols['sources'].get(symbol[7:])
+         if output != None and source != None and not output in symbols['outputs'].get(source, ()):
+            unresolved.append((symbol + '.' + output, location))
+      elif symbol.startswith('var.') or symbol.startswith('data.'):
+         if not symbol in declared:
+            unresolved.append((symbol, location))
+      elif symbol[0:symbol.find('.')] in symbols['types']:
+         if not symbol in declared:
+            unresolved.append((symbol, location))
+
+   # Rows of a range row share a location and a cell can repeat a
+   # reference, so each reference is reported once per row.
+   unresolved = list(dict.fromkeys(unresolved))
+
+   for symbol, location in unresolved:
+      printmessage(options, unresolvedreferencemessage % ((symbol,) + location))
+
+   return unresolved
+
+# Provider schema check
+
+# Arguments and blocks of every resource not listed in provider schemas.
+metaarguments = ['count', 'for_each', 'depends_on', 'provider']
+metablocks = ['lifecycle', 'provisioner', 'connection']
+
+# Names given by headercolumns() to columns with an empty header. Spacer
+# columns without data are dropped when generating, and the header alone
+# does not tell them apart, so they are not checked.
+unnamedpattern = re.compile(r'Unnamed: \d+(\.\d+)*$')
+
+# Load resource schemas of all providers from the output of
+# terraform providers schema -json. Resource types are indexed by
+# schemablock() when first used.
+# Returns None when the file can't be read.
+def loadschema(options):
+   try:
+      with open(options['schema'], 'r') as f:
+         dump = json.load(f)
+   except (OSError, ValueError):
+      return None
+
+   if not isinstance(dump, dict):
+      return None
+
+   schema = {
+   'resources': {},
+   'index': {}
+   }
+   for provider in dump.get('provider_schemas', {}).values():
+      schema['resources'].update(provider.get('resource_schemas', {}))
+
+   return schema
+
+# Index block as attributes, True if they can be set, and nested blocks.
+def indexblock(block):
+   attributes = {}
+   for attribute, properties in block.get('attributes', {}).items():
+      # Computed attributes are read-only unless also optional.
+      attributes[attribute] = properties.get('required', False) or properties.get('optional', False) or not properties.get('computed', False)
+
+   blocks = {}
+   for blockname, blocktype in block.get('block_types', {}).items():
+      blocks[blockname] = indexblock(blocktype.get('block', {}))
+
+   return {'attributes': attributes, 'blocks': blocks}
+
+def schemablock(schema, resourcetype):
+   index = schema['index']
+
+   if not resourcetype in index:
+      resourceschema = schema['resources'].get(resourcetype)
+      if resourceschema == None:
+         index[resourcetype] = None
       else:
-         module = module.replace(' ', '')
- 
-      tfname = os.path.join(module, tfname)
+         index[resourcetype] = indexblock(resourceschema.get('block', {}))
 
-      comments = row['comments']
-      empty = novalue(comments)
-      if not empty:
-         printline(options, tfname, '# ' + comments)
+   return index[resourcetype]
+
+# Check attributes of emission plan against block.
+# Returns message, attribute and column position of each error.
+def checkplan(plan, block):
+   errors = []
+
+   for columnindex, prefix, group, openlines, closelines in plan:
+      if prefix == None:
+         continue
+      attribute = prefix[0:-3]
+      path = attribute
 
-      if resource_data == True:
-         printline(options, tfname, dataheader % (resources[sheettype], resource))
-         value = row['name']
-         empty = novalue(value)
-         if empty:
-            print(missingvaluemessage % ('resource', rowindex))
+      target = block
+      if group != None:
+         blockname = group.rstrip('0123456789')
+         if blockname in metablocks:
+            continue
+         path = blockname + '.' + attribute
+         target = block['blocks'].get(blockname)
+         if target == None:
+            errors.append((unknownattributemessage, path, columnindex))
             continue
-         printline(options, tfname, 'name = ' + value)
-         printline(options, tfname, enddata)
+      elif attribute in metaarguments:
          continue
 
-      printline(options, tfname, resourceheader % (resources[sheettype], resource))
+      writable = target['attributes'].get(attribute)
+      if writable == None:
+         errors.append((unknownattributemessage, path, columnindex))
+      elif not writable:
+         errors.append((readonlyattributemessage, path, columnindex))
 
-      savegroup = None
+   return errors
 
-      # Loop through columns skipping first 2 columns (file and resource) and last 2 columns (module and comments).
-      for columnindex in range(columns.size-2):
-         if columnindex < 2:
-            continue
+# Check compiled columns of resource sheet against schema of its resource
+# type once per sheet.
+# Returns invalid columns with message, attribute, resource type and location.
+def checksheetschema(options, schema, name, columns):
+   generator = sheetgenerator(name)
 
-         column = columns[columnindex]
-         value = row[column]
-         empty = novalue(value)
-         if empty:
-            continue
+   if generator == genresources:
+      spec = sheetspecs['resources']
+   elif generator == genaclresources:
+      spec = sheetspecs['aclrules']
+   else:
+      return []
+
+   resourcetype = resources.get(sheettypeof(name))
+   if resourcetype == None or len(columns) == 0:
+      return []
+
+   block = schemablock(schema, resourcetype)
+   if block == None:
+      printmessage(options, missingschemamessage % (resourcetype, name))
+      return []
+
+   plan, headerplan = sheetplans(columns, spec)
+
+   errors = checkplan(plan, block)
+   if spec['rules']:
+      # Columns are attributes of resource rows or of rules rows.
+      rulesblock = block['blocks'].get('rules')
+      if rulesblock == None:
+         errors = checkplan(headerplan, block)
+      else:
+         headererrors = set(columnindex for message, attribute, columnindex in checkplan(headerplan, block))
+         errors = [error for error in checkplan(plan, rulesblock) if error[2] in headererrors]
+
+   invalid = []
+   for message, attribute, columnindex in errors:
+      if unnamedpattern.match(columns[columnindex]):
+         continue
+      invalid.append((message, attribute, resourcetype, (options['propname'], name, columns[columnindex])))
+
+   return invalid
+
+# Check columns of resource sheets of all workbooks against provider schema
+# before any output is written. Only the header row of sheets is read
+# unless the sheet is read by pandas.
+# Returns invalid columns with workbook, sheet and column.
+def checkschema(options, jobs, schema):
+   invalid = []
+
+   for job in jobs:
+      # Sheets are loaded again for generation so loads are not counted here.
+      for name, table in streamsheets(dict(job, stats=None)):
+         invalid.extend(checksheetschema(job, schema, name.replace(' ', ''), table['columns']))
+
+   for message, attribute, resourcetype, location in invalid:
+      printmessage(options, message % ((attribute, resourcetype) + location))
+
+   return invalid
+
+# Resource compaction
+
+# Group rows of resource sheet with the same file, module and columns set.
+# Groups of rows that differ in fewer columns than they share are compacted
+# into one for_each resource over a map keyed by resource name with the
+# differing columns as values.
+# Returns groups with rows by position and resource names by module of
+# rows that are not data sources.
+def compactsheet(name, table):
+   columns = table['columns']
+
+   positions = dict(zip(columns, range(len(columns))))
+
+   for column in ['file', 'resource', 'module', 'comments']:
+      if not column in positions:
+         return [], {}
+
+   filecolumn = positions['file']
+   resourcecolumn = positions['resource']
+   modulecolumn = positions['module']
+
+   plan, headerplan = sheetplans(columns, sheetspecs['resources'])
+   entries = [entry for entry in plan if entry[1] != None]
+   columnindexes = [entry[0] for entry in entries]
+
+   candidates = {}
+   names = {}
+   modules = {}
+   for position, (rowindex, row, rowmask) in enumerate(table['rows']):
+      if not rowmask[filecolumn] or not rowmask[resourcecolumn]:
+         continue
+      resource = row[resourcecolumn].replace(' ', '')
+      if resource.startswith('data.'):
+         continue
+
+      module = '.'
+      if rowmask[modulecolumn]:
+         module = modules.get(row[modulecolumn])
+         if module == None:
+            module = os.path.normpath(row[modulecolumn].replace(' ', '')) or '.'
+            modules[row[modulecolumn]] = module
+      modulenames = names.get(module)
+      if modulenames == None:
+         modulenames = []
+         names[module] = modulenames
+      modulenames.append(resource)
+
+      key = (row[filecolumn], module, tuple([rowmask[columnindex] for columnindex in columnindexes]))
+      members = candidates.get(key)
+      if members == None:
+         members = []
+         candidates[key] = members
+      members.append((position, resource, [row[columnindex] for columnindex in columnindexes]))
+
+   groups = []
+   for key, members in candidates.items():
+      tfname, module, mask = key
+      if len(members) < 2 or len(set(member[1] for member in members)) < len(members):
+         continue
 
+      varying = []
+      shared = 0
+      compactable = True
+      for entryindex, entry in enumerate(entries):
+         if not mask[entryindex]:
+            continue
+         columnindex, prefix, group, openlines, closelines = entry
+         attribute = prefix[0:-3]
+         values = set(member[2][entryindex] for member in members)
+         if group == None and attribute in ['count', 'for_each']:
+            compactable = False
+         elif len(values) == 1:
+            shared += 1
+         elif group == None and attribute in metaarguments or group != None and group.rstrip('0123456789') in metablocks:
+            # Meta-arguments can't refer to each.value.
+            compactable = False
+         elif group == None:
+            varying.append((columnindex, attribute))
+         else:
+            varying.append((columnindex, group + '_' + attribute))
+
+      if compactable and len(varying) < shared:
+         group = {
+         'module': module,
+         'rows': [member[0] for member in members],
+         'names': [member[1] for member in members],
+         'varying': varying,
+         'type': None,
+         'label': None
+         }
+         groups.append(group)
+
+   return groups, names
+
+# Find rows of resource sheets of all workbooks to compact and name the
+# for_each resources after the common prefix, or else suffix, of the
+# resource names of their rows. Sheets are kept in jobs to be generated without reading the
+# workbooks again.
+# Returns groups by workbook and sheet, addresses of compacted resources
+# and addresses of all resources by module.
+def compactresources(options, jobs):
+   compacted = {
+   'groups': {},
+   'addresses': {},
+   'names': {}
+   }
+
+   groups = []
+   for job in jobs:
+      frames = []
+      for name, sheet, frame in loadframes(job):
+         name = name.replace(' ', '')
+         frames.append((name, frame))
+         sheettype = sheettypeof(name)
+         if sheetgenerator(name) != genresources or not sheettype in resources:
+            continue
+         sheetgroups, names = compactsheet(name, expandtable(sheettable(frame)))
+         for module, modulenames in names.items():
+            compacted['names'].setdefault(module, []).extend(resources[sheettype] + '.' + resource for resource in modulenames)
+         for group in sheetgroups:
+            group['type'] = resources[sheettype]
+         if len(sheetgroups) > 0:
+            compacted['groups'][(job['propname'], name)] = sheetgroups
+            groups.extend(sheetgroups)
+      job['frames'] = frames
+
+   # Names of resources left as they are can't be used for groups.
+   grouped = set((group['module'], group['type'] + '.' + resource) for group in groups for resource in group['names'])
+   taken = set((module, address) for module, addresses in compacted['names'].items() for address in addresses)
+   taken.difference_update(grouped)
+
+   for group in groups:
+      label = os.path.commonprefix(group['names']).rstrip('-_0123456789')
+      if label == '':
+         label = os.path.commonprefix([resource[::-1] for resource in group['names']])[::-1].lstrip('-_0123456789')
+      if label == '':
+         label = group['names'][0]
+      candidate = label
+      count = 1
+      while (group['module'], group['type'] + '.' + candidate) in taken:
+         count += 1
+         candidate = '%s_%s' % (label, count)
+      taken.add((group['module'], group['type'] + '.' + candidate))
+      group['label'] = candidate
+
+      addresses = compacted['addresses'].setdefault(group['module'], {})
+      for resource in group['names']:
+         addresses[group['type'] + '.' + resource] = '%s.%s["%s"]' % (group['type'], candidate, resource)
+
+   return compacted
+
+# Append lines of for_each resource of compacted group.
+# Differing columns are emitted as each.value references.
+def emitgroup(lines, plan, group, resourcetype, rows, commentscolumn):
+   lines.append(resourceheader % (resourcetype, group['label']))
+
+   lines.append('for_each = {')
+   for position, resource in zip(group['rows'], group['names']):
+      rowindex, row, rowmask = rows[position]
+      if rowmask[commentscolumn]:
+         lines.append('# ' + row[commentscolumn])
+      lines.append('"%s" = {' % resource)
+      for columnindex, key in group['varying']:
+         value = row[columnindex]
          if isinstance(value, int):
             value = str(value)
+         lines.append(key + ' = ' + value)
+      lines.append('}')
+   lines.append('}')
 
-         column = column.replace(' ', '')
+   rowindex, row, rowmask = rows[group['rows'][0]]
+   row = list(row)
+   for columnindex, key in group['varying']:
+      row[columnindex] = 'each.value.' + key
+   emitplan(lines, plan, row, rowmask)
 
-         dotpos = column.find('.')
-         if dotpos >= 0:
-            subgroup = column[0:dotpos]
-            subcolumn = column[dotpos+1:]
-            column = subcolumn
-            if savegroup == None:
-               # No group yet so start group.
-               savegroup = subgroup
-               # Remove trailing digits from duplicated columns of arrays.
-               subgroup = subgroup.rstrip('0123456789')
-               printline(options, tfname, subgroup + ' {')
-            elif savegroup != subgroup:
-               # Adjacent groups so close previous group and start next group.
-               savegroup = subgroup
-               # Remove trailing digits from duplicated columns of arrays.
-               subgroup = subgroup.rstrip('0123456789')
-               printline(options, tfname, '}')
-               printline(options, tfname, subgroup + ' {')
-         elif savegroup != None:
-            # End of group so close group.
-            savegroup = None
-            printline(options, tfname, '}')
-
-         printline(options, tfname, column + ' = ' + value)
-
-      if savegroup != None:
-         # End of row so close group.
-         savegroup = None
-         printline(options, tfname, '}')
-
-      printline(options, tfname, endresource)
+   lines.append(endresource)
+
+   return
+
+def rewritereferences(moves, value):
+   if not isinstance(value, str) or value.find('.') < 0:
+      return value
+
+   return referencepattern.sub(lambda match: moves.get(match.group(0), match.group(0)) if match.group(9) != None else match.group(0), value)
+
+# Rows with references to compacted resources replaced by their address
+# in the for_each resource.
+def compactedrows(addresses, generator, table):
+   columns = table['columns']
+
+   positions = dict(zip(columns, range(len(columns))))
+
+   filecolumn = positions.get('file')
+   modulecolumn = positions.get('module')
+   # Module sheets are written to the root module.
+   if generator == genmodules:
+      modulecolumn = None
+
+   module = '.'
+   for rowindex, row, rowmask in table['rows']:
+      # Rules of ACL follow the header row without file.
+      if modulecolumn != None and filecolumn != None and rowmask[filecolumn]:
+         module = '.'
+         if rowmask[modulecolumn]:
+            module = os.path.normpath(row[modulecolumn].replace(' ', '')) or '.'
+      moves = addresses.get(module)
+      if moves != None:
+         row = [rewritereferences(moves, value) for value in row]
+      yield rowindex, row, rowmask
+
+   return
+
+def loadmoved(options):
+   pathname = os.path.join(options['genpath'], movedname)
+   if not os.path.isfile(pathname):
+      return None
+
+   try:
+      with open(pathname, 'r') as f:
+         return json.load(f)
+   except ValueError:
+      return None
+
+# Write moved blocks for resources with a different address than in the
+# previous output and the addresses of compacted resources for the next run.
+# Without --compact, resources compacted before are moved back until they
+# are compacted again.
+def genmoved(options, compacted, previous):
+   moves = {}
+   if compacted != None:
+      record = {'compact': True, 'addresses': compacted['addresses']}
+      for module, addresses in compacted['names'].items():
+         previousaddresses = {}
+         if previous != None and previous['compact']:
+            previousaddresses = previous['addresses'].get(module, {})
+         targets = compacted['addresses'].get(module, {})
+         for address in addresses:
+            source = previousaddresses.get(address, address)
+            target = targets.get(address, address)
+            # Moves are kept until the address changes again.
+            if source == target:
+               source = address
+            if source != target:
+               moves.setdefault(module, []).append((source, target))
+   elif previous != None:
+      record = {'compact': False, 'addresses': previous['addresses']}
+      for module, addresses in previous['addresses'].items():
+         for address, source in addresses.items():
+            moves.setdefault(module, []).append((source, address))
+   else:
+      return
+
+   if len(record['addresses']) == 0 and len(moves) == 0:
+      return
+
+   for module, modulemoves in moves.items():
+      tfname = os.path.join(module, movedfile)
+      for source, target in modulemoves:
+         printline(options, tfname, movedheader)
+         printline(options, tfname, 'from = ' + source)
+         printline(options, tfname, 'to = ' + target)
+         printline(options, tfname, endmoved)
+
+   flushlines(options)
+
+   pathname = os.path.join(options['genpath'], movedname)
+   with open(pathname, 'w') as f:
+      json.dump(record, f, indent=2, sort_keys=True)
 
    return
 
@@ -914,32 +2938,98 @@ def gentf(options):
    propfile = options['propfile']
    propname = options['propname']
 
-   print(starttfmessage % propfile)
-
-   sheets = loadfile(options)
-   for name, sheet in sheets.items():
-      name = name.replace(' ', '')
-
-      df = loadframe(options, pd, sheet)
-
-      if name.find('variables', 0, 9) >= 0:
-         genvariables(options, name, sheet, df)
-      elif name.find('outputs', 0, 7) >= 0:
-         genoutputs(options, name, sheet, df)
-      elif name.find('cloudinits', 0, 10) >= 0:
-         gencloudinits(options, name, sheet, df)
-      elif name.find('modules', 0, 7) >= 0:
-         genmodules(options, name, sheet, df)
-      elif name.find('providers', 0, 9) >= 0:
-         genproviders(options, name, sheet, df)
-      elif name.find('versions', 0, 8) >= 0:
-         genversions(options, name, sheet, df)
-      elif name.find('aclrules', 0, 8) >= 0:
-         genaclresources(options, name, sheet, df)
-      else:
-         genresources(options, name, sheet, df)
+   printmessage(options, starttfmessage % propfile)
+
+   if options['stream'] and not options['incremental'] and options['cachepath'] == None:
+      for name, table in streamsheets(options):
+         name = name.replace(' ', '')
+         gensheet(options, name, table)
+   else:
+      for name, sheet, frame in loadframes(options):
+         name = name.replace(' ', '')
+
+         if options['incremental']:
+            gensheetincremental(options, name, frame)
+         else:
+            gensheet(options, name, sheettable(frame))
 
-   print(donetfmessage % (propname, genpath))
+   flushlines(options)
+
+   # Output rendered into an update folder is reported at the output folder.
+   printmessage(options, donetfmessage % (propname, options.get('outputpath', genpath)))
+
+   return
+
+# Forked workers of a process with other threads running can deadlock on
+# locks held by those threads, so pools started while library callers run
+# threads use new interpreters instead.
+def poolcontext():
+   if threading.active_count() > 1:
+      return multiprocessing.get_context('spawn')
+
+   return None
+
+# Process pool entry point for one workbook.
+# Console output and writes are captured and returned to be merged in order.
+def gentfjob(options):
+   options['writer'] = newwriter(True)
+   if options['stats'] != None:
+      options['stats'] = newstats()
+
+   options['log'] = io.StringIO()
+   gentf(options)
+   log = options['log'].getvalue()
+
+   return log, options['writer']['deferred'], options.get('sheets'), options['stats']
+
+# Generate changed workbooks and update output folder from sheet fragments.
+def gentfincremental(options, jobs, manifest, workers, updatepath, previousmoved):
+   workbooks = manifest['workbooks']
+
+   pending = []
+   for job in jobs:
+      propfile = job['propfile']
+      job['filehash'] = hashfile(propfile)
+      previous = workbooks.get(propfile)
+      if previous != None and previous['hash'] == job['filehash']:
+         printmessage(options, unchangedinputmessage % propfile)
+         job['sheets'] = previous['sheets']
+         continue
+      job['sheets'] = []
+      job['previous'] = {}
+      if previous != None:
+         for sheet in previous['sheets']:
+            job['previous'][sheet['name']] = sheet
+      pending.append(job)
+
+   if workers > 1 and len(pending) > 1:
+      import concurrent.futures
+      with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=poolcontext()) as executor:
+         for job, result in zip(pending, executor.map(gentfjob, [dict(job, log=None) for job in pending])):
+            log, deferred, sheets, stats = result
+            printmessage(options, log, end='')
+            mergestats(options, stats)
+            job['sheets'] = sheets
+   else:
+      for job in pending:
+         job['writer'] = newwriter(True)
+         gentf(job)
+
+   entries = []
+   workbooks = {}
+   for job in jobs:
+      workbooks[job['propfile']] = {'hash': job['filehash'], 'sheets': job['sheets']}
+      for sheet in job['sheets']:
+         entries.extend(sheet['entries'])
+
+   writeimage(options, entries, updatepath)
+
+   # Resources are not compacted so resources compacted before are moved back.
+   genmoved(dict(options, genpath=updatepath, writer=newwriter()), None, previousmoved)
+
+   manifest['outputs'] = commitoutput(options, updatepath, manifest['outputs'], options['writer']['kept'])
+   manifest['workbooks'] = workbooks
+   savemanifest(options, manifest)
 
    return
 
@@ -947,13 +3037,57 @@ def main():
    print(COPYRIGHT)
    print(toolheader)
 
+   options = dict(defaultoptions)
+
    parser = argparse.ArgumentParser(description=toolheader)
 
    parser.add_argument('inputvalue', nargs='?', default=options['datapath'], help='input folder (default: ' + options['datapath'] + ')')
 
    parser.add_argument('-o', action='store', dest='outputfolder', default=options['genpath'], help='output folder (default: ' + options['genpath'] + ')')
 
-   parser.add_argument('-t', dest='datatype', default=options['datatype'], help='type of input files (default: ' + options['datatype'] + ')')
+   parser.add_argument('-t', dest='datatype', default=options['datatype'], help='type of input files: xlsx, xls, csv, tsv, json or jsonl (default: ' + options['datatype'] + ')')
+
+   parser.add_argument('-j', '--jobs', type=int, dest='jobs', default=options['jobs'], help='number of workbooks to process in parallel, 0 for all cores (default: ' + str(options['jobs']) + ')')
+
+   parser.add_argument('-u', '--update', action='store_true', dest='update', help='update output folder in place, replacing only files with changed content')
+
+   parser.add_argument('-r', '--reader', dest='reader', choices=['auto', 'openpyxl', 'calamine', 'pandas'], default=options['reader'], help='reader for xlsx files, auto uses calamine if installed (default: ' + options['reader'] + ')')
+
+   parser.add_argument('-i', '--incremental', action='store_true', dest='incremental', help='update output folder in place, regenerating only changed workbooks and sheets')
+
+   parser.add_argument('--cache', dest='cachepath', default=options['cachepath'], help='folder for cache of parsed workbooks (default: no cache)')
+
+   parser.add_argument('--cache-size', type=int, dest='cachesize', default=options['cachesize'], help='maximum cache size in megabytes (default: ' + str(options['cachesize']) + ')')
+
+   parser.add_argument('--cache-age', type=int, dest='cacheage', default=options['cacheage'], help='remove cache entries unused for this many days (default: ' + str(options['cacheage']) + ')')
+
+   parser.add_argument('--archive', dest='archive', choices=['none', 'zip', 'tar.gz', 'tar.zst'], default=options['archive'], help='compress backup of output folder into archive (default: ' + options['archive'] + ')')
+
+   parser.add_argument('--keep-backups', type=int, dest='keepbackups', default=options['keepbackups'], help='number of newest backups to keep, 0 keeps all (default: ' + str(options['keepbackups']) + ')')
+
+   parser.add_argument('--keep-days', type=int, dest='keepdays', default=options['keepdays'], help='remove backups older than this many days except the newest, 0 keeps all (default: ' + str(options['keepdays']) + ')')
+
+   parser.add_argument('--staging', dest='staging', choices=['copy', 'link', 'reflink', 'inplace'], default=options['staging'], help='how .terraform is carried over from the backup: copy, link (hardlink), reflink (copy-on-write clone) or inplace (left in output folder), falling back to copy (default: ' + options['staging'] + ')')
+
+   parser.add_argument('--cloudinits', dest='cloudinits', choices=['copy', 'link'], default=options['cloudinits'], help='how cloudinits files are placed in the output folder: copy or link (hardlink, so edits of output files change input files), falling back to copy (default: ' + options['cloudinits'] + ')')
+
+   parser.add_argument('-c', '--check', action='store_true', dest='check', help='check references to resources, data sources, variables and modules of all workbooks before writing output')
+
+   parser.add_argument('--schema', dest='schema', default=options['schema'], help='check resource sheet columns against provider schema file from terraform providers schema -json before writing output')
+
+   parser.add_argument('--compact', action='store_true', dest='compact', help='generate one for_each resource for rows of a resource sheet that differ in fewer columns than they share, not used with --incremental or --stream')
+
+   parser.add_argument('-s', '--stream', action='store_true', dest='stream', help='stream rows from input to output with memory bounded by the buffer size, not used with --incremental or --cache')
+
+   parser.add_argument('-b', '--buffer-size', type=int, dest='buffersize', default=options['buffersize'] // 1048576, help='megabytes of output buffered before writing (default: ' + str(options['buffersize'] // 1048576) + ')')
+
+   parser.add_argument('--stats', action='store_true', dest='stats', help='print load, generate and write times per sheet and output file statistics')
+
+   parser.add_argument('--stats-json', dest='statspath', default=options['statspath'], help='also save statistics as JSON to file, implies --stats')
+
+   parser.add_argument('--profile', dest='profile', default=options['profile'], help='save cProfile statistics of the run to file, workbooks are then processed one at a time')
+
+   parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', help='report additional details while processing')
 
    parser.add_argument('--version', action='version', version='tabular-terraform ' + COPYRIGHT.split(' ')[1])
 
@@ -962,47 +3096,164 @@ def main():
    options['datapath'] = results.inputvalue.replace(' ', '')
    options['datatype'] = results.datatype.replace(' ', '')
    options['genpath'] = results.outputfolder.replace(' ', '')
+   options['jobs'] = results.jobs
+   options['incremental'] = results.incremental
+   options['update'] = results.update
+   options['reader'] = results.reader
+   options['verbose'] = results.verbose
+   options['cachepath'] = results.cachepath
+   options['cachesize'] = results.cachesize
+   options['cacheage'] = results.cacheage
+   options['stream'] = results.stream
+   options['check'] = results.check
+   options['schema'] = results.schema
+   options['compact'] = results.compact
+   options['staging'] = results.staging
+   options['cloudinits'] = results.cloudinits
+   options['archive'] = results.archive
+   options['keepbackups'] = results.keepbackups
+   options['keepdays'] = results.keepdays
+   options['buffersize'] = results.buffersize * 1048576
+   options['statspath'] = results.statspath
+   if results.stats or results.statspath != None:
+      options['stats'] = newstats()
+   options['profile'] = results.profile
+
+   result = generate(options)
+
+   if result != None and (len(result['invalid']) > 0 or len(result['unresolved']) > 0):
+      sys.exit(1)
 
+   return
+
+# Generate output folder from input folder with options.
+# Returns result of run or None when input folder, schema file or statistics
+# file is not valid.
+def generate(options):
    datapath = options['datapath']
    datatype = options['datatype']
    genpath = options['genpath']
   
    # Check for existing input directory and exit if not valid.
    if not os.path.isdir(os.path.join(datapath, datatype)):
-      print(invalidinputdirectorymessage % os.path.join(datapath, datatype))
+      printmessage(options, invalidinputdirectorymessage % os.path.join(datapath, datatype))
+      return
+
+   schema = None
+   if options['schema'] != None:
+      schema = loadschema(options)
+      if schema == None:
+         printmessage(options, invalidschemamessage % options['schema'])
+         return
+
+   # Check statistics file can be saved before anything is written.
+   if options['stats'] != None and options['statspath'] != None and not writablefile(options['statspath']):
+      printmessage(options, invalidstatsfilemessage % options['statspath'])
       return
 
+   start = time.perf_counter()
+   profiler = None
+   if options['profile'] != None:
+      import cProfile
+      profiler = cProfile.Profile()
+      profiler.enable()
+
+   filelist = os.listdir(os.path.join(datapath, datatype))
+
+   # Collect all files in specified directory.
+   jobs = []
+   for afile in filelist:
+      propfile = os.path.join(datapath, datatype, afile)
+      propfilenopath = os.path.basename(propfile)
+      propname = os.path.splitext(propfilenopath)[0]
+      propext = os.path.splitext(propfilenopath)[1][1:]
+      workbook = os.path.isfile(propfile)
+      if os.path.isdir(propfile) and datatype.lower() in tabletypes:
+         # Folder of table files is a workbook.
+         workbook = True
+         propname = propfilenopath
+         propext = datatype
+      if workbook:
+         job = dict(options)
+         job['propfile'] = propfile
+         job['propname'] = propname
+         job['propext'] = propext
+         jobs.append(job)
+   found = len(jobs) > 0
+
+   # Check columns and references before anything is written.
+   invalid = []
+   if schema != None:
+      invalid = checkschema(options, jobs, schema)
+   unresolved = []
+   if options['check']:
+      unresolved = checkreferences(options, jobs)
+   if len(invalid) > 0 or len(unresolved) > 0:
+      if len(invalid) > 0:
+         printmessage(options, invalidcolumnsmessage % len(invalid))
+      if len(unresolved) > 0:
+         printmessage(options, uncheckedoutputmessage % len(unresolved))
+      if profiler != None:
+         profiler.disable()
+      result = {
+      'inputpath': datapath,
+      'outputpath': genpath,
+      'workbooks': [job['propfile'] for job in jobs],
+      'outputs': [],
+      'backup': None,
+      'stats': options['stats'],
+      'invalid': invalid,
+      'unresolved': unresolved
+      }
+      return result
+
+   # Compact resources and keep addresses of resources compacted before.
+   previousmoved = loadmoved(options)
+   compacted = None
+   if options['compact'] and not options['incremental'] and not options['stream']:
+      compacted = compactresources(options, jobs)
+      for job in jobs:
+         job['compacted'] = compacted
+
+   manifest = None
    genbackup = None
+   if options['incremental'] or options['update']:
+      # Update existing output directory in place.
+      manifest = loadmanifest(options)
    # Check for existing output directory and backup if exists.
-   if os.path.exists(genpath):
-      backup = 1
-      found = False
-      genbackup = None
+   elif os.path.exists(genpath):
       # Find a new backup directory.
-      while not found:
-         genbackup = genpath + '.backup' + str(backup)
-         if os.path.exists(genbackup):
-            backup += 1
-         else:
-            found = True
+      backups = loadbackups(options)
+      genbackup = newbackup(options, backups)
+      # Keep .terraform in output directory.
+      terraformpath = os.path.join(genpath, '.terraform')
+      terraformstaging = None
+      if options['staging'] == 'inplace' and os.path.isdir(terraformpath):
+         terraformstaging = genbackup + '.terraform'
+         os.rename(terraformpath, terraformstaging)
       # Move existing output directory to backup directory.
       shutil.move(genpath, genbackup)
-      print(backupdirectorymessage % (genpath, genbackup))
+      printmessage(options, backupdirectorymessage % (genpath, genbackup))
+      if terraformstaging != None:
+         os.makedirs(genpath)
+         os.rename(terraformstaging, terraformpath)
 
    # Create new empty output directory.
-   os.makedirs(genpath)
+   if not os.path.exists(genpath):
+      os.makedirs(genpath)
 
    # Copy existing terraform.tfstate to output directory.
+   # State is rewritten in place by terraform so it is never hardlinked.
    if genbackup != None and os.path.isfile(os.path.join(genbackup, 'terraform.tfstate')):
-      shutil.copy(os.path.join(genbackup, 'terraform.tfstate'), os.path.join(genpath, 'terraform.tfstate'))
+      stagefile(options, os.path.join(genbackup, 'terraform.tfstate'), os.path.join(genpath, 'terraform.tfstate'))
 
    # Copy existing .terraform to output directory.
    if genbackup != None and os.path.isdir(os.path.join(genbackup, '.terraform')):
-      shutil.copytree(os.path.join(genbackup, '.terraform'), os.path.join(genpath, '.terraform'))
+      stagefolder(options, os.path.join(genbackup, '.terraform'), os.path.join(genpath, '.terraform'))
 
-   datapath = options['datapath']
-   datatype = options['datatype']
-   filelist = os.listdir(os.path.join(datapath, datatype))
+   # Archive backup and remove old backups.
+   if genbackup != None:
+      retainbackups(options, backups, genbackup)
 
    # Copy terraform-cloudinits if exists to output directory.
    #if os.path.isdir(os.path.join(datapath, 'terraform-cloudinits')):
@@ -1010,9 +3261,17 @@ def main():
    #   for terraformfile in terraformfiles:
    #      shutil.copy(os.path.join(datapath, 'terraform-cloudinits', terraformfile), genpath)
 
+   # Render into update folder when updating output directory in place.
+   updatepath = None
+   writepath = genpath
+   if manifest != None:
+      updatepath = newupdatefolder(options)
+      writepath = updatepath
+
    # Copy ansible-playbooks if exists to output directory.
    if os.path.isdir(os.path.join(datapath, 'playbooks')):
-      shutil.copytree(os.path.join(datapath, 'playbooks'), os.path.join(genpath, 'playbooks'))         
+      # Playbooks are not hardlinked to keep edits of output out of input.
+      stagefolder(options, os.path.join(datapath, 'playbooks'), os.path.join(writepath, 'playbooks'), shared=False)
 
    # Generate provider.
    #print(startprovidermessage)
@@ -1022,22 +3281,126 @@ def main():
    #print(startversionsmessage)
    #genversions(options)
 
+   # Generate workbooks into output or update folder.
+   if not options['incremental']:
+      for job in jobs:
+         job['genpath'] = writepath
+         job['outputpath'] = genpath
+
+
+   options['writer'] = newwriter()
+   if updatepath != None:
+      options['writer']['updatepath'] = updatepath
+      options['writer']['outputpath'] = genpath
+
+   workers = options['jobs']
+   if workers < 1:
+      workers = os.cpu_count()
+   if options['stream']:
+      # Parallel workers would hold the output of whole workbooks.
+      workers = 1
+   if options['profile'] != None:
+      # Only the main process is profiled.
+      workers = 1
+
    # Process all files in specified directory.
-   found = False
-   for afile in filelist:
-      propfile = os.path.join(datapath, datatype, afile)
-      propfilenopath = os.path.basename(propfile)
-      propname = os.path.splitext(propfilenopath)[0]
-      propext = os.path.splitext(propfilenopath)[1][1:]
-      if (os.path.isfile(propfile)):
-         found = True
-         options['propfile'] = propfile
-         options['propname'] = propname
-         options['propext'] = propext
-         gentf(options)
-   if (not found):
-      print(missinginputmessage % results.inputvalue)
+   if options['incremental']:
+      gentfincremental(options, jobs, manifest, workers, updatepath, previousmoved)
+   elif workers > 1 and len(jobs) > 1:
+      # Workbooks are rendered in parallel and merged in directory order
+      # so shared output files match a serial run.
+      import concurrent.futures
+      with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=poolcontext()) as executor:
+         for log, deferred, sheets, stats in executor.map(gentfjob, [dict(job, log=None) for job in jobs]):
+            printmessage(options, log, end='')
+            mergestats(options, stats)
+            replaywriter(options, deferred)
+   else:
+      for job in jobs:
+         job['writer'] = options['writer']
+         gentf(job)
+   if not options['incremental']:
+      genmoved(dict(options, genpath=writepath), compacted, previousmoved)
+   if options['update'] and not options['incremental']:
+      manifest['outputs'] = commitoutput(options, updatepath, manifest['outputs'], options['writer']['kept'])
+      manifest['workbooks'] = {}
+      savemanifest(options, manifest)
+
+   if not found:
+      printmessage(options, missinginputmessage % options['datapath'])
+
+   evictcache(options)
+
+   if profiler != None:
+      profiler.disable()
+      profiler.dump_stats(options['profile'])
+      import pstats
+      pstats.Stats(profiler, stream=options['log'] if options['log'] != None else sys.stdout).sort_stats('cumulative').print_stats(20)
+      printmessage(options, savedprofilemessage % options['profile'])
+
+   if options['stats'] != None:
+      printstats(options, time.perf_counter() - start)
+
+   if manifest != None:
+      outputs = manifest['outputs']
+   else:
+      outputs = outputfiles(options)
+
+   result = {
+   'inputpath': datapath,
+   'outputpath': genpath,
+   'workbooks': [job['propfile'] for job in jobs],
+   'outputs': outputs,
+   'backup': genbackup,
+   'stats': options['stats'],
+   'invalid': invalid,
+   'unresolved': unresolved
+   }
+
+   return result
+
+# Files generated in output folder, without state carried over from backup.
+def outputfiles(options):
+   genpath = options['genpath']
 
-   return
-      
-main()
+   outputs = []
+   for root, dirs, files in os.walk(genpath):
+      if root == genpath and '.terraform' in dirs:
+         dirs.remove('.terraform')
+      for afile in files:
+         relpath = os.path.relpath(os.path.join(root, afile), genpath)
+         if relpath != 'terraform.tfstate':
+            outputs.append(relpath)
+
+   return sorted(outputs)
+
+# Library entry point.
+# Generates Terraform files in outputpath from the input folder inputpath
+# like the command line, with keyword arguments for options named as in
+# defaultoptions (e.g. datatype='csv', jobs=4, update=True, stats=True,
+# log=stream). Each call has its own options so calls can run in threads.
+# Returns dict with workbooks read, output files relative to outputpath,
+# backup folder and stats, or None when the input folder, schema file or
+# statistics file is not valid.
+# With jobs from threads workers are spawned and import the caller's main
+# module, which then needs the usual if __name__ == '__main__' guard.
+def transform(inputpath, outputpath, **kwargs):
+   options = dict(defaultoptions)
+
+   for key, value in kwargs.items():
+      if not key in defaultoptions or key in ['datapath', 'genpath', 'propfile', 'propname', 'propext']:
+         raise TypeError('transform() got an unexpected keyword argument %s' % key)
+      options[key] = value
+
+   options['datapath'] = inputpath
+   options['genpath'] = outputpath
+   if options['stats'] == True:
+      options['stats'] = newstats()
+   elif options['stats'] == False:
+      options['stats'] = None
+
+   return generate(options)
+
+if __name__ == '__main__':
+   multiprocessing.freeze_support()
+   main()